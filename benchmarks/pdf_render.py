@@ -0,0 +1,159 @@
+"""Micro-benchmark for create_intake_pdf with regression thresholds.
+
+Renders small, typical and oversized intake payloads, each with and without the
+logo, and measures wall time, peak traced memory and PDF size. Results are
+compared with pdf_baseline.json next to this file; any metric that is worse than
+its baseline by more than --threshold percent fails the run (exit status 1).
+
+    python benchmarks/pdf_render.py                    # compare with the baseline
+    python benchmarks/pdf_render.py --update-baseline  # record a new baseline
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_baseline.json")
+METRICS = ("wall_ms", "peak_kb", "size_bytes")
+
+
+# --- PAYLOADS ---
+TYPICAL = {
+    "lang": "en",
+    "history": [10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27],
+    "p_name": "Selamawit Tesfaye",
+    "p_addr": "Bole Sub-city, Woreda 03, Addis Ababa",
+    "p_age": "29",
+    "p_phone": "+251 911 234 567",
+    "p_edd": "12/05/2018",
+    "p_w_b": "62",
+    "p_w_n": "70",
+    "p_birth": "Normal",
+    "p_gender": "F",
+    "p_diet": "No pork, fasting on Wednesdays and Fridays",
+    "p_risk": "None",
+    "p_allergy": "Penicillin",
+    "p_breast": "Yes",
+    "p_lang": "Amharic",
+    "p_notes": "Prefers morning visits; second child",
+    "p_home": "Villa",
+    "p_pkg": "Full40",
+    "p_id_file": "AgACAgQAAxkBAAIBQ2X",
+}
+
+PAYLOADS = {
+    "small": {"lang": "en", "p_name": "Hana", "p_phone": "0911000000", "p_pkg": "Half30"},
+    "typical": TYPICAL,
+    # Long free-text answers and extra keys: several pages and ~100x the typical text
+    "oversized": {**TYPICAL, **{f"p_{key}": (value + " ") * 60 for key, value in TYPICAL.items()
+                                if key.startswith("p_") and key != "p_id_file"},
+                  **{f"p_extra_{i}": "Additional note " * 20 for i in range(40)}},
+}
+
+
+# --- MEASUREMENT ---
+def measure(bot, data, repeats):
+    for _ in range(2):
+        bot.create_intake_pdf(data)  # warm caches (logo, fonts)
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        pdf = bot.create_intake_pdf(data)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    bot.create_intake_pdf(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # Best of N: the least noisy estimate of the render cost itself
+    return {"wall_ms": round(1000 * min(timings), 3),
+            "peak_kb": round(peak / 1024, 1),
+            "size_bytes": len(pdf.getvalue())}
+
+def run(bot, repeats):
+    from pdf_documents import _logo_cache
+    logo_path = bot.LOGO_PATH
+    results = {}
+    for logo in (True, False):
+        bot.LOGO_PATH = logo_path if logo else os.path.join(ROOT, "no-logo.webp")
+        _logo_cache.clear()
+        for name, data in PAYLOADS.items():
+            results[f"{name}/{'logo' if logo else 'no-logo'}"] = measure(bot, data, repeats)
+    bot.LOGO_PATH = logo_path
+    _logo_cache.clear()
+    return results
+
+def compare(results, baseline, threshold):
+    """Return a description of every metric that regressed by more than threshold percent."""
+    regressions = []
+    for case, metrics in results.items():
+        for metric in METRICS:
+            old = baseline.get(case, {}).get(metric)
+            if not old:
+                continue
+            change = 100 * (metrics[metric] - old) / old
+            if change > threshold:
+                regressions.append(f"{case} {metric}: {old} -> {metrics[metric]} (+{change:.1f}%)")
+    return regressions
+
+def report(results, baseline):
+    print(f"{'case':<20}{'wall ms':>10}{'peak KB':>10}{'size B':>10}   vs baseline")
+    for case, m in results.items():
+        old = baseline.get(case)
+        delta = "" if not old else "  ".join(
+            f"{metric.split('_')[0]} {100 * (m[metric] - old[metric]) / old[metric]:+.1f}%"
+            for metric in METRICS if old.get(metric))
+        print(f"{case:<20}{m['wall_ms']:>10.2f}{m['peak_kb']:>10.1f}{m['size_bytes']:>10}   {delta}")
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=50, help="timed renders per case (%(default)s)")
+    parser.add_argument("--threshold", type=float, default=25.0,
+                        help="allowed regression in percent for any metric (%(default)s)")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file (%(default)s)")
+    parser.add_argument("--update-baseline", action="store_true", help="store these results as the new baseline")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="agos-pdf-bench-")
+    atexit.register(shutil.rmtree, workdir, True)
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("LOGO_PATH", os.path.join(ROOT, "logo.webp"))
+    os.environ.setdefault("SUBMISSIONS_DB_PATH", os.path.join(workdir, "submissions.sqlite3"))
+    os.environ.setdefault("OUTBOX_DB_PATH", os.path.join(workdir, "outbox.sqlite3"))
+    os.environ.setdefault("FILE_ID_CACHE_PATH", os.path.join(workdir, "file_ids.sqlite3"))
+    sys.path.insert(0, ROOT)
+    import main as bot
+
+    results = run(bot, args.repeats)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+    if not baseline:
+        print("\nNo baseline yet; run with --update-baseline to record one")
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"\nRegressions over {args.threshold}%:")
+        for line in regressions:
+            print(f"  {line}")
+        return 1
+    print(f"\nNo regressions over {args.threshold}%")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,258 @@
+"""Offline end-to-end throughput benchmark.
+
+Starts a stand-in Telegram Bot API server on localhost, points the bot at it through
+BOT_API_BASE_URL and replays scripted users through the Flask ``webhook()``: menu
+clicks, the full 18-step intake with the ID photo and the decor booking with the
+payment photo. No network access or real bot token is needed.
+
+    python benchmarks/throughput.py --users 50 --concurrency 8
+    WEBHOOK_ACK_MODE=queue python benchmarks/throughput.py --api-latency 30
+
+With WEBHOOK_ACK_MODE=queue the per-handler latencies are acknowledgement times and
+the total time includes draining the update queue.
+
+Any main.py setting can be overridden through the environment as usual. Telegram's
+flood limits are lifted unless --real-limits is given.
+"""
+import argparse
+import atexit
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "123456:BENCHMARK"
+ADMIN_ID = 999
+
+
+# --- FAKE BOT API ---
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Answers every Bot API method with a minimal successful result."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive, so the bot's connection pool is exercised as in production
+    disable_nagle_algorithm = True  # headers and body go out in separate writes; don't let delayed ACKs stall them
+    latency = 0.0
+    calls = {}
+    _ids = itertools.count(1)
+    _lock = threading.Lock()
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+        payload = json.dumps({"ok": True, "result": self._result(method, body)}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _result(self, method, body):
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Agos", "username": "agos_bench_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if method in ("answerCallbackQuery", "setWebhook", "deleteWebhook"):
+            return True
+        match = (re.search(rb'name="chat_id"\r\n\r\n(-?\d+)', body)
+                 or re.search(rb'chat_id=(-?\d+)', body)
+                 or re.search(rb'"chat_id": ?(-?\d+)', body))
+        chat_id = int(match.group(1)) if match else ADMIN_ID
+        message_id = next(self._ids)
+        message = {"message_id": message_id, "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+        if method == "sendDocument":
+            message["document"] = {"file_id": f"DOC{message_id}", "file_unique_id": f"d{message_id}"}
+        elif method == "sendPhoto":
+            message["photo"] = [{"file_id": f"PHO{message_id}", "file_unique_id": f"p{message_id}",
+                                 "width": 90, "height": 90}]
+        return message
+
+    def log_message(self, *args):
+        pass
+
+
+def start_fake_api(latency):
+    FakeBotAPI.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBotAPI)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-bot-api", daemon=True).start()
+    return server
+
+
+# --- SCRIPTED TRAFFIC ---
+_update_ids = itertools.count(1)
+
+def _user(chat_id):
+    return {"id": chat_id, "is_bot": False, "first_name": f"Bench{chat_id}"}
+
+def command(chat_id, text):
+    update = text_message(chat_id, text)
+    update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return update
+
+def text_message(chat_id, text):
+    return {"update_id": next(_update_ids),
+            "message": {"message_id": next(_update_ids), "date": int(time.time()), "text": text,
+                        "chat": {"id": chat_id, "type": "private"}, "from": _user(chat_id)}}
+
+def photo_message(chat_id):
+    update = text_message(chat_id, "")
+    del update["message"]["text"]
+    update["message"]["photo"] = [{"file_id": f"USERPHOTO{chat_id}", "file_unique_id": f"u{chat_id}",
+                                   "width": 1280, "height": 960}]
+    return update
+
+def callback(chat_id, data):
+    return {"update_id": next(_update_ids),
+            "callback_query": {"id": str(next(_update_ids)), "chat_instance": str(chat_id), "data": data,
+                               "from": _user(chat_id),
+                               "message": {"message_id": 1, "date": int(time.time()), "text": "menu",
+                                           "chat": {"id": chat_id, "type": "private"}}}}
+
+def user_script(chat_id):
+    """(handler, update) pairs for one user: menu browsing, an intake and a decor booking."""
+    c = chat_id
+    steps = [
+        ("start", command(c, "/start")),
+        ("show_menu", callback(c, "lang_en")),
+        ("info_pages", callback(c, "info_care")),
+        ("show_menu", callback(c, "menu")),
+        ("info_pages", callback(c, "info_decor")),
+        ("show_menu", callback(c, "menu")),
+        ("p_start", callback(c, "p_start")),
+        ("p_q1", callback(c, "p_agree")),
+    ]
+    intake_answers = [
+        ("p_q2", f"Bench Mother {c}"), ("p_q3", "Bole, Addis Ababa"), ("p_q4", "29"),
+        ("p_q5", f"+2519{c % 100000000:08d}"), ("p_q6", "12/05/2018"), ("p_q7", "62"), ("p_q8", "70"),
+        ("p_q9", "Normal"), ("p_q10", "F"), ("p_q11", "No restrictions"), ("p_q12", "None"),
+        ("p_q13", "None"), ("p_q14", "Yes"), ("p_q15", "Amharic"), ("p_q16", "Prefers mornings"),
+        ("p_q17", "Villa"), ("p_q18", "Full40"),
+    ]
+    callback_steps = {"p_q9", "p_q10", "p_q14", "p_q17", "p_q18"}
+    for handler, answer in intake_answers:
+        steps.append((handler, callback(c, answer) if handler in callback_steps else text_message(c, answer)))
+    steps.append(("p_final", photo_message(c)))
+    steps += [
+        ("show_menu", callback(c, "menu")),
+        ("d_start", callback(c, "d_start")),
+        ("d_step1", text_message(c, f"Bench Decor {c}")),
+        ("d_step2", callback(c, "Female")),
+        ("d_step3", text_message(c, "CMC, Addis Ababa")),
+        ("d_step4", text_message(c, f"09{c % 100000000:08d}")),
+        ("d_step5", text_message(c, "Sister")),
+        ("d_step6", callback(c, "20k")),
+        ("d_step7", text_message(c, "20/06/2018")),
+        ("d_step8", callback(c, "Villa")),
+        ("d_step9", text_message(c, "Pink and white")),
+        ("d_final", photo_message(c)),
+    ]
+    return steps
+
+
+# --- RUNNER ---
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # nearest rank
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+def run(bot, users, concurrency):
+    scripts = [user_script(100000 + i) for i in range(users)]
+    latencies = {}
+    failures = []
+    lock = threading.Lock()
+    pending = iter(scripts)
+
+    def worker():
+        client = bot.flask_app.test_client()
+        while True:
+            with lock:
+                script = next(pending, None)
+            if script is None:
+                return
+            for handler, update in script:
+                started = time.perf_counter()
+                response = client.post(f"/{TOKEN}", json=update)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.setdefault(handler, []).append(elapsed)
+                    if response.status_code != 200:
+                        failures.append((handler, response.status_code))
+
+    threads = [threading.Thread(target=worker, name=f"bench-user-{i}") for i in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if bot.WEBHOOK_ACK_MODE == "queue":
+        # Webhooks were only acknowledged; the clock stops once the consumers are done
+        bot.get_bot_loop().run(bot.update_queue.queue.join())
+    return time.perf_counter() - started, latencies, failures
+
+def report(elapsed, latencies, failures):
+    total = sum(len(v) for v in latencies.values())
+    rows = {}
+    for handler, values in latencies.items():
+        values.sort()
+        rows[handler] = {"count": len(values), "p50_ms": 1000 * percentile(values, 50),
+                         "p95_ms": 1000 * percentile(values, 95), "p99_ms": 1000 * percentile(values, 99)}
+    print(f"\n{total} updates in {elapsed:.2f}s -> {total / elapsed:.1f} updates/s "
+          f"({len(failures)} non-200 responses)\n")
+    print(f"{'handler':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for handler, row in rows.items():
+        print(f"{handler:<12}{row['count']:>8}{row['p50_ms']:>10.2f}{row['p95_ms']:>10.2f}{row['p99_ms']:>10.2f}")
+    print(f"\nBot API calls: {dict(sorted(FakeBotAPI.calls.items()))}")
+    return {"updates": total, "seconds": elapsed, "updates_per_second": total / elapsed,
+            "failures": len(failures), "handlers": rows, "bot_api_calls": FakeBotAPI.calls}
+
+def cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20, help="scripted users (%(default)s)")
+    parser.add_argument("--concurrency", type=int, default=4, help="users replayed in parallel (%(default)s)")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="fake Bot API latency in ms (%(default)s)")
+    parser.add_argument("--real-limits", action="store_true", help="keep Telegram's flood limits")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    server = start_fake_api(args.api_latency / 1000)
+    workdir = tempfile.mkdtemp(prefix="agos-bench-")
+    atexit.register(shutil.rmtree, workdir, True)  # runs after main.py's own shutdown hook
+    os.environ.update(BOT_TOKEN=TOKEN, ADMIN_ID=str(ADMIN_ID),
+                      BOT_API_BASE_URL=f"http://127.0.0.1:{server.server_port}/bot",
+                      BOT_API_BASE_FILE_URL=f"http://127.0.0.1:{server.server_port}/file/bot")
+    os.environ.setdefault("LOGO_PATH", os.path.join(ROOT, "logo.webp"))
+    for name, filename in (("SUBMISSIONS_DB_PATH", "submissions.sqlite3"), ("OUTBOX_DB_PATH", "outbox.sqlite3"),
+                           ("PERSISTENCE_PATH", "state.sqlite3"),
+                           ("FILE_ID_CACHE_PATH", "file_ids.sqlite3")):
+        os.environ.setdefault(name, os.path.join(workdir, filename))
+    if not args.real_limits:
+        os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "100000")
+        os.environ.setdefault("TELEGRAM_CHAT_RATE", "100000")
+        os.environ.setdefault("TELEGRAM_CHAT_BURST", "100000")
+    sys.path.insert(0, ROOT)
+    import main as bot
+
+    if bot.WEBHOOK_LOOP_MODE == "persistent":
+        bot.get_bot_loop()  # keep bot start-up out of the measurement
+    elapsed, latencies, failures = run(bot, args.users, args.concurrency)
+    results = report(elapsed, latencies, failures)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,14 @@
+"""Gunicorn settings, picked up automatically from the working directory.
+
+    gunicorn --bind 0.0.0.0:8080 main:flask_app
+    gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 main:asgi_app
+"""
+
+
+def post_fork(server, worker):
+    # Bring the bot up while the worker boots rather than on its first webhook. The
+    # uvicorn worker does the same from the ASGI lifespan startup.
+    if type(worker).__module__.startswith("uvicorn"):
+        return
+    import main
+    main.boot_worker()
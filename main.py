@@ -1,18 +1,55 @@
+import time
+_startup_clock = time.perf_counter()
 import os
+import csv
+import cProfile
+import hashlib
+import hmac
+import json
+import sys
+import atexit
+import functools
 import asyncio
 import logging
+import re
+import sqlite3
+import threading
+import multiprocessing
+import zipfile
 import nest_asyncio  # Add this line
-from io import BytesIO
+from io import BytesIO, StringIO
+from bisect import bisect_left
+from datetime import date, timedelta
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from urllib.parse import parse_qs
+from xml.sax.saxutils import escape as xml_escape
+
+# Milliseconds spent on each startup step, reported in the log and on /debug
+startup_timings = {}
+
+def startup_mark(step):
+    """Record the time since the previous mark under ``step``."""
+    global _startup_clock
+    now = time.perf_counter()
+    startup_timings[step] = round(1000 * (now - _startup_clock), 1)
+    _startup_clock = now
+
+startup_mark("import stdlib")
 # ... rest of your imports
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, Update, ReplyKeyboardRemove)
+# ReportLab and Pillow are imported on first use, see pdf_documents.pdf_stack()
+from pdf_documents import flatten_image, prewarm_pdf, render_intake_pdf, render_terms_pdf, timed_render_intake
+from telegram import (InlineKeyboardButton, InlineKeyboardMarkup, Update, ReplyKeyboardRemove, InputMediaPhoto)
 from telegram.ext import (Application, CommandHandler, CallbackQueryHandler,
-                          MessageHandler, filters, ContextTypes, ConversationHandler)
-from flask import Flask, request, Response
-
-nest_asyncio.apply()  # Allow nested event loops
+                          filters, ContextTypes, ConversationHandler,
+                          BasePersistence, PersistenceInput, BaseUpdateProcessor, BaseRateLimiter,
+                          BaseHandler)
+from telegram.error import RetryAfter, BadRequest, TimedOut, NetworkError
+from telegram.request import HTTPXRequest
+import httpx
+startup_mark("import telegram")
+from flask import Flask, request, Response, jsonify
+startup_mark("import flask")
 
 # --- LOGGING SETUP ---
 logging.basicConfig(
@@ -25,9 +62,78 @@ logger = logging.getLogger(__name__)
 TOKEN = os.environ.get("BOT_TOKEN")
 ADMIN_ID = int(os.environ.get("ADMIN_ID", "123456789"))  # fallback to dummy
 LOGO_PATH = os.environ.get("LOGO_PATH", "logo.webp")
+MEDIA_DIR = os.environ.get("MEDIA_DIR", "media")  # gallery images sent with the Media page
+TERMS_AS_DOCUMENT = os.environ.get("TERMS_AS_DOCUMENT", "1") != "0"  # one PDF message with the agree button
+TERMS_FONT_PATH = os.environ.get("TERMS_FONT_PATH")  # TTF with Ge'ez glyphs; Amharic terms stay text without it
+FILE_ID_CACHE_PATH = os.environ.get("FILE_ID_CACHE_PATH", "agos_file_ids.sqlite3")
+SINGLE_CARD_MODE = os.environ.get("SINGLE_CARD_MODE", "0") != "0"  # edit one bot message per chat in place
+# Alternative Bot API server (a self-hosted one, or a local stand-in for benchmarks);
+# the token is appended to the base URL as with https://api.telegram.org/bot
+BOT_API_BASE_URL = os.environ.get("BOT_API_BASE_URL")
+BOT_API_BASE_FILE_URL = os.environ.get("BOT_API_BASE_FILE_URL")
+# One pooled HTTP client per worker for Bot API calls, plus a separate small pool for
+# getUpdates-style long polling so it can never starve message sending
+BOT_POOL_SIZE = int(os.environ.get("BOT_POOL_SIZE", "256"))
+BOT_GET_UPDATES_POOL_SIZE = int(os.environ.get("BOT_GET_UPDATES_POOL_SIZE", "1"))
+BOT_POOL_TIMEOUT = float(os.environ.get("BOT_POOL_TIMEOUT", "1"))  # seconds to wait for a free connection
+BOT_KEEPALIVE_EXPIRY = float(os.environ.get("BOT_KEEPALIVE_EXPIRY", "30"))  # idle seconds before closing
+# "persistent": one long-lived event loop per worker (default)
+# "per_request": legacy mode, a new nested event loop for every webhook call
+WEBHOOK_LOOP_MODE = os.environ.get("WEBHOOK_LOOP_MODE", "persistent")
+WEBHOOK_PROCESS_TIMEOUT = float(os.environ.get("WEBHOOK_PROCESS_TIMEOUT", "55"))
+# "sync": answer the webhook after the update is processed (default)
+# "queue": answer as soon as the update is queued; consumers process it in the background
+WEBHOOK_ACK_MODE = os.environ.get("WEBHOOK_ACK_MODE", "sync")
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_QUEUE_HIGH_WATER = int(os.environ.get("UPDATE_QUEUE_HIGH_WATER", str(UPDATE_QUEUE_SIZE)))
+UPDATE_CONSUMERS = int(os.environ.get("UPDATE_CONSUMERS", "8"))
+DEDUP_TTL = float(os.environ.get("DEDUP_TTL", "3600"))  # seconds an update_id is remembered
+DEDUP_MAX_ENTRIES = int(os.environ.get("DEDUP_MAX_ENTRIES", "10000"))
+DEDUP_DB_PATH = os.environ.get("DEDUP_DB_PATH")  # optional SQLite file shared by all workers
+# "" keeps conversations in memory only; "sqlite" shares them between workers
+PERSISTENCE_BACKEND = os.environ.get("PERSISTENCE_BACKEND", "")
+PERSISTENCE_PATH = os.environ.get("PERSISTENCE_PATH", "agos_state.sqlite3")
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get("PERSISTENCE_FLUSH_INTERVAL", "1"))
+UPDATE_MAX_CONCURRENCY = int(os.environ.get("UPDATE_MAX_CONCURRENCY", "32"))
+PDF_EXECUTOR = os.environ.get("PDF_EXECUTOR", "thread")  # "thread" or "process"
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "2"))
+PDF_TIMEOUT = float(os.environ.get("PDF_TIMEOUT", "20"))  # seconds before p_final gives up on the PDF
+PDF_MAX_PENDING = int(os.environ.get("PDF_MAX_PENDING", "50"))
+# Telegram flood limits: ~30 messages/s overall, ~1/s per chat (short bursts ok), 20/min per group
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = int(os.environ.get("TELEGRAM_CHAT_BURST", "3"))
+TELEGRAM_GROUP_RATE = float(os.environ.get("TELEGRAM_GROUP_RATE", str(20 / 60)))
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES", "3"))
+OUTBOX_DB_PATH = os.environ.get("OUTBOX_DB_PATH", "agos_outbox.sqlite3")
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "20"))
+OUTBOX_FLUSH_INTERVAL = float(os.environ.get("OUTBOX_FLUSH_INTERVAL", "5"))
+OUTBOX_MAX_BACKOFF = float(os.environ.get("OUTBOX_MAX_BACKOFF", "300"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "20"))
+SUBMISSIONS_DB_PATH = os.environ.get("SUBMISSIONS_DB_PATH", "agos_submissions.sqlite3")
+ADMIN_PAGE_SIZE = int(os.environ.get("ADMIN_PAGE_SIZE", "10"))
+ADMIN_API_TOKEN = os.environ.get("ADMIN_API_TOKEN", "")  # enables /export and /debug/profile when set
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_MAX_SECONDS = float(os.environ.get("PROFILE_MAX_SECONDS", "300"))
+# /ready turns 503 when the worker's bot loop is lagging or backed up beyond these limits
+WATCHDOG_INTERVAL = float(os.environ.get("WATCHDOG_INTERVAL", "0.5"))
+READY_MAX_LOOP_LAG = float(os.environ.get("READY_MAX_LOOP_LAG", "1"))  # seconds
+READY_MAX_IN_FLIGHT = int(os.environ.get("READY_MAX_IN_FLIGHT", str(UPDATE_MAX_CONCURRENCY * 4)))
+READY_MAX_QUEUE_DEPTH = int(os.environ.get("READY_MAX_QUEUE_DEPTH", str(UPDATE_QUEUE_HIGH_WATER // 2)))
 
 if not TOKEN:
     raise ValueError("BOT_TOKEN environment variable not set!")
+if WEBHOOK_LOOP_MODE not in ("persistent", "per_request"):
+    raise ValueError(f"Unknown WEBHOOK_LOOP_MODE: {WEBHOOK_LOOP_MODE}")
+if WEBHOOK_ACK_MODE not in ("sync", "queue"):
+    raise ValueError(f"Unknown WEBHOOK_ACK_MODE: {WEBHOOK_ACK_MODE}")
+if WEBHOOK_ACK_MODE == "queue" and WEBHOOK_LOOP_MODE == "per_request":
+    raise ValueError("WEBHOOK_ACK_MODE=queue needs the persistent event loop")
+if PDF_EXECUTOR not in ("thread", "process"):
+    raise ValueError(f"Unknown PDF_EXECUTOR: {PDF_EXECUTOR}")
+
+if WEBHOOK_LOOP_MODE == "per_request":
+    nest_asyncio.apply()  # Allow nested event loops
 
 # --- CONVERSATION STATES ---
 (P_TERMS, P_NAME, P_ADDR, P_AGE, P_PHONE, P_EDD, P_W_BEFORE, P_W_NOW,
@@ -160,9 +266,11 @@ CONTENT = {
             "📍 Piassa, Abat Commercial"
         ),
         'agree_btn': "I Agree ✅",
+        'terms_caption': "📋 Please read the attached service agreement, then tap I Agree to continue.",
         'back': "🔙 Back to Menu",
         'change_lang': "🌍 Change Language / ቋንቋ ቀይር",
-        'q_back': "⬅️ Previous Question"
+        'q_back': "⬅️ Previous Question",
+        'stale_button': "This button is no longer active. Please answer the latest question."
     },
     'am': {
         'welcome': "🌿 *እንኳን ወደ አጎስ የድህረ ወሊድ እንክብካቤ በሰላም መጡ* 🌸",
@@ -288,9 +396,11 @@ CONTENT = {
             "📍 ፒያሳ፣ አባት ኮሜርሻል"
         ),
         'agree_btn': "እስማማለሁ ✅",
+        'terms_caption': "📋 እባክዎ የተያያዘውን የአገልግሎት ውል ስምምነት ያንብቡ፣ ከዚያ ለመቀጠል እስማማለሁ የሚለውን ይጫኑ።",
         'back': "🔙 ወደ ዋና ማውጫ",
         'change_lang': "🌍 Change Language / ቋንቋ ቀይር",
-        'q_back': "⬅️ ወደ ኋላ ተመለስ"
+        'q_back': "⬅️ ወደ ኋላ ተመለስ",
+        'stale_button': "ይህ ቁልፍ ከአሁን በኋላ አይሰራም። እባክዎ የመጨረሻውን ጥያቄ ይመልሱ።"
     }
 }
 
@@ -414,56 +524,315 @@ Article Eight: Settlement of Disputes
 Any dispute arising out of or in connection with this agreement shall be amicably settled by the two parties through negotiation. If the case is not settled amicably through negotiation, the dispute shall be settled by Ethiopian regular federal competent court.
 """
 
+# --- PRECOMPILED UI ---
+# Keyboards and terms chunks are built once per language at import and handlers only
+# look them up. tests/test_ui.py checks that every static text sent with
+# parse_mode='Markdown' is balanced, so a broken entity fails CI instead of a request.
+TERMS = {'en': TERMS_EN, 'am': TERMS_AM}
+TERMS_CHUNK_LIMIT = 3800  # Telegram's message limit is 4096
+_MARKDOWN_TOKEN_RE = re.compile(r"\\[_*`\[]|\[[^\]]*\]\([^)]*\)|[_*`]")
+
+def split_paragraphs(text, limit, separators=("\n\n", "\n", " ")):
+    """Pack whole paragraphs into chunks of at most ``limit`` characters.
+
+    A paragraph that is longer than the limit is split on line breaks, then on
+    spaces, so a chunk never ends inside a word or an entity that fits on one line.
+    """
+    if len(text) <= limit:
+        return [text] if text.strip() else []
+    if not separators:
+        return [text[i:i + limit] for i in range(0, len(text), limit)]
+    separator = separators[0]
+    chunks, current = [], ""
+    for piece in text.split(separator):
+        joined = f"{current}{separator}{piece}" if current else piece
+        if len(joined) <= limit:
+            current = joined
+            continue
+        if current.strip():
+            chunks.append(current)
+        current = piece
+        if len(piece) > limit:
+            *full, current = split_paragraphs(piece, limit, separators[1:])
+            chunks.extend(full)
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+def markdown_unbalanced(text):
+    """Offset of an entity left open in legacy Telegram Markdown, or None.
+
+    Entities do not nest there: inside one, only its own marker is special. Escaped
+    markers and [text](url) links are skipped as a whole.
+    """
+    opened = None
+    for match in _MARKDOWN_TOKEN_RE.finditer(text):
+        token = match.group()
+        if opened is None:
+            if len(token) == 1:
+                opened = match
+        elif token == opened.group():
+            opened = None
+    return None if opened is None else opened.start()
+
+def pdf_plain_text(text):
+    """Terms text for the PDF: no Markdown bold markers and no emoji (outside the BMP)."""
+    return "".join(ch for ch in text.replace("**", "") if ord(ch) <= 0xFFFF).strip()
+
+def terms_document(lang):
+    """What the terms PDF for ``lang`` is rendered from, or None when no font covers it.
+
+    Helvetica covers cp1252 only; other scripts need TERMS_FONT_PATH. ``version``
+    changes with the text or font, so an edited agreement is uploaded again.
+    """
+    text = pdf_plain_text(TERMS[lang])
+    try:
+        text.encode("cp1252")
+        font_path = None
+    except UnicodeEncodeError:
+        if not TERMS_FONT_PATH:
+            return None
+        font_path = TERMS_FONT_PATH
+    version = hashlib.sha256(f"{font_path}\n{text}".encode()).hexdigest()[:16]
+    return {"asset": f"terms_{lang}.pdf", "version": version, "text": text, "font_path": font_path,
+            "filename": f"Agos_Service_Agreement_{lang.upper()}.pdf"}
+
+def build_ui(lang):
+    content = CONTENT[lang]
+    btns = content['btns']
+    return {
+        'menu': InlineKeyboardMarkup([
+            [InlineKeyboardButton(btns[0], callback_data='info_care'), InlineKeyboardButton(btns[1], callback_data='info_decor')],
+            [InlineKeyboardButton(btns[2], callback_data='info_arrival'), InlineKeyboardButton(btns[3], callback_data='info_media')],
+            [InlineKeyboardButton(btns[5], callback_data='p_start'), InlineKeyboardButton(btns[6], callback_data='d_start')],
+            [InlineKeyboardButton(btns[4], callback_data='info_contact'), InlineKeyboardButton(content['change_lang'], callback_data='restart')]
+        ]),
+        'menu_back': InlineKeyboardMarkup([[InlineKeyboardButton(content['back'], callback_data='menu')]]),
+        'terms': tuple(split_paragraphs(TERMS[lang], TERMS_CHUNK_LIMIT)),
+        'terms_document': terms_document(lang) if TERMS_AS_DOCUMENT else None,
+        'terms_kb': InlineKeyboardMarkup([
+            [InlineKeyboardButton(content['agree_btn'], callback_data='p_agree')],
+            [InlineKeyboardButton(content['back'], callback_data='menu')]
+        ]),
+    }
+
+LANGUAGE_KB = InlineKeyboardMarkup([[InlineKeyboardButton("English 🇺🇸", callback_data='lang_en')],
+                                    [InlineKeyboardButton("አማርኛ 🇪🇹", callback_data='lang_am')]])
+UI = {lang: build_ui(lang) for lang in CONTENT}
+
+# --- METRICS ---
+# Prometheus text exposition served at /metrics. Recording is a dict lookup and a few
+# additions under a per-metric lock that is only ever held for those additions.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)
+METRICS = []
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(names, values, extra=None):
+    pairs = list(zip(names, values)) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_label_value(v)}"' for k, v in pairs) + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.values = {}
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = list(self.values.items())
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in values:
+            yield f"{self.name}{_label_text(self.labels, label_values)} {value}"
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [count per bucket..., count above the last bucket, sum]
+        self._lock = threading.Lock()
+        METRICS.append(self)
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            series = [(k, list(v)) for k, v in self.series.items()]
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        for label_values, counts in series:
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                yield f"{self.name}_bucket{_label_text(self.labels, label_values, ('le', bound))} {total}"
+            yield f"{self.name}_sum{_label_text(self.labels, label_values)} {counts[-1]}"
+            yield f"{self.name}_count{_label_text(self.labels, label_values)} {total}"
+
+class Gauge:
+    """Gauge sampled at scrape time; ``collect`` returns {label values: value}."""
+
+    def __init__(self, name, help_text, labels, collect):
+        self.name, self.help_text, self.labels = name, help_text, labels
+        self.collect = collect
+        METRICS.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} gauge"
+        for label_values, value in self.collect().items():
+            yield f"{self.name}{_label_text(self.labels, label_values)} {value}"
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        try:
+            lines.extend(list(metric.render()))
+        except Exception as e:
+            logger.warning(f"Could not collect {metric.name}: {e}")
+    return "\n".join(lines) + "\n"
+
+HANDLER_SECONDS = Histogram("agos_handler_seconds", "Conversation handler latency.", ("handler",))
+PDF_RENDER_SECONDS = Histogram("agos_pdf_render_seconds", "Intake PDF render time inside the executor.")
+PDF_BYTES = Histogram("agos_pdf_bytes", "Intake PDF size.", buckets=SIZE_BUCKETS)
+TELEGRAM_API_SECONDS = Histogram("agos_telegram_api_seconds", "Bot API call latency (rate limit waits excluded).",
+                                 ("method",))
+WEBHOOK_REQUESTS = Counter("agos_webhook_requests_total", "Webhook requests by response status.", ("status",))
+CHAT_QUEUE_WAIT_SECONDS = Histogram("agos_chat_queue_wait_seconds",
+                                    "Time an update waited for earlier updates of the same chat.")
+
+def timed(handler):
+    """Record the handler's latency in agos_handler_seconds under its function name."""
+    name = handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await handler(*args, **kwargs)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+    return wrapper
+
 # --- PDF GENERATOR WITH LOGO ---
+# Rendering itself lives in pdf_documents.py, the only module a process-pool worker
+# has to import; this section snapshots user_data for it and keeps it off the loop.
+def intake_snapshot(data):
+    """Compact, picklable copy of the intake fields that go on the PDF."""
+    return tuple((key, str(value)) for key, value in data.items()
+                 if key.startswith('p_') and key not in ['history', 'p_id_file'])
+
 def create_intake_pdf(data):
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Try to add Logo if it exists
-    if os.path.exists(LOGO_PATH):
+    return BytesIO(render_intake_pdf(intake_snapshot(data), LOGO_PATH))
+
+class PdfRenderer:
+    """Awaitable front end for rendering intake PDFs off the event loop."""
+
+    def __init__(self, kind, workers, timeout, max_pending):
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = 0  # queued or running in the executor, including jobs we stopped waiting for
+        self._pending_lock = threading.Lock()
+        self.timeouts = 0
+        self.rejected = 0
+        self._executor = None
+        self._pid = None
+
+    def executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            if self.kind == "process":
+                # Never fork the multi-threaded worker; spawn clean renderer processes
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="pdf-render")
+            self._pid = os.getpid()
+        return self._executor
+
+    async def run(self, func, *args):
+        """Run ``func(*args)`` in the executor; raises when saturated or too slow."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise RuntimeError(f"PDF renderer saturated ({self.pending} pending)")
+        with self._pending_lock:
+            self.pending += 1
+        job = self.executor().submit(func, *args)
+        # A timed-out job keeps its worker busy until it returns, so count it until then
+        job.add_done_callback(self._job_done)
         try:
-            logo = ImageReader(LOGO_PATH)
-            c.drawImage(logo, 480, height - 80, width=60, height=60, mask='auto')
-        except Exception as e:
-            logger.warning(f"Could not load logo: {e}")
-    
-    c.setFont("Helvetica-Bold", 18)
-    c.drawString(50, height - 50, "Agos Postpartum Care")
-    c.setFont("Helvetica", 12)
-    c.drawString(50, height - 70, "Official Intake Confirmation Form")
-    c.line(50, height - 85, 550, height - 85)
-    c.setFont("Helvetica", 11)
-    y_position = height - 120
-    
-    for key, value in data.items():
-        if key.startswith('p_') and key not in ['history', 'p_id_file']:
-            label = key[2:].replace('_', ' ').upper()
-            text = f"{label}: {value}"
-            c.drawString(50, y_position, text)
-            y_position -= 25
-            if y_position < 60:
-                c.showPage()
-                y_position = height - 50
-    
-    c.setFont("Helvetica-Oblique", 9)
-    c.drawString(50, 40, "Generated via Agos Telegram Bot. Verified submission.")
-    c.save()
-    buffer.seek(0)
-    return buffer
+            return await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def _job_done(self, job):
+        with self._pending_lock:
+            self.pending -= 1
+
+    async def render(self, data):
+        """Render the intake in user_data to a BytesIO."""
+        pdf, elapsed = await self.run(timed_render_intake, intake_snapshot(data), LOGO_PATH)
+        PDF_RENDER_SECONDS.observe(elapsed)
+        PDF_BYTES.observe(len(pdf))
+        return BytesIO(pdf)
+
+    def prewarm(self):
+        """Warm the executor's workers in the background so the first intake skips the imports."""
+        def record(future):
+            if not future.cancelled() and future.exception() is None:
+                startup_timings["pdf prewarm (background)"] = round(1000 * future.result(), 1)
+        futures = [self.executor().submit(prewarm_pdf, LOGO_PATH) for _ in range(self.workers)]
+        futures[0].add_done_callback(record)
+
+    def stats(self):
+        return {"executor": self.kind, "workers": self.workers, "pending": self.pending,
+                "timeouts": self.timeouts, "rejected": self.rejected}
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+
+pdf_renderer = PdfRenderer(PDF_EXECUTOR, PDF_WORKERS, PDF_TIMEOUT, PDF_MAX_PENDING)
+Gauge("agos_pdf_render_pending", "PDF renders queued or running in the executor.", (),
+      lambda: {(): pdf_renderer.pending})
 
 # --- HELPERS ---
-async def send_terms(update, text, keyboard):
-    chunks = [text[i:i+3800] for i in range(0, len(text), 3800)]
+async def send_terms(update, lang):
     target = update.callback_query.message if update.callback_query else update.message
-    for i, chunk in enumerate(chunks):
-        if i == len(chunks) - 1:
-            await target.reply_text(chunk, reply_markup=keyboard, parse_mode='Markdown')
-        else:
-            await target.reply_text(chunk, parse_mode='Markdown')
-
-def get_back_kb(lang):
-    return InlineKeyboardMarkup([[InlineKeyboardButton(CONTENT[lang]['q_back'], callback_data='p_back')]])
+    document = UI[lang]['terms_document']
+    if document is not None:
+        try:
+            await file_id_cache.send(
+                document["asset"], document["version"],
+                lambda pdf: target.reply_document(pdf, filename=document["filename"],
+                                                  caption=CONTENT[lang]['terms_caption'],
+                                                  reply_markup=UI[lang]['terms_kb']),
+                lambda: pdf_renderer.run(render_terms_pdf, document["text"], document["font_path"], LOGO_PATH))
+            return
+        except Exception as e:
+            logger.error(f"❌ Terms document failed, sending the text instead: {e!r}")
+    chunks = UI[lang]['terms']
+    for chunk in chunks[:-1]:
+        await target.reply_text(chunk, parse_mode='Markdown')
+    await target.reply_text(chunks[-1], reply_markup=UI[lang]['terms_kb'], parse_mode='Markdown')
 
 def get_amharic_label(key):
     labels = {
@@ -487,226 +856,293 @@ def get_amharic_label(key):
     }
     return labels.get(f'p_{key}', key)
 
+CARD_RENDERS = Counter("agos_card_renders_total", "Bot screens by how they reached the chat.", ("result",))
+
+def _card_target(update, context):
+    """(chat_id, message_id) of the message to edit, or None to send a new one.
+
+    A button press edits the message it was pressed on; a typed answer edits the
+    tracked card. Messages without text (documents, photos) are skipped here instead
+    of costing a failed edit call. Bots may edit their own messages at any age, so
+    there is no cutoff; the 48-hour limit only applies to deleting them.
+    """
+    query = update.callback_query
+    if query is not None:
+        message = query.message
+        if message is None or message.text is None:
+            return None
+        return message.chat_id, message.message_id
+    card = context.user_data.get('card')
+    if card is None or card[0] != update.effective_chat.id:
+        return None
+    return card[0], card[1]  # cards saved by older releases also carried the send time
+
+async def render_card(update, context, text, reply_markup=None, parse_mode=None, new=False):
+    """Show a bot screen: by default as a reply, in SINGLE_CARD_MODE by editing the chat's card.
+
+    Edits only carry inline keyboards, so any other markup (or ``new``) sends a fresh
+    message, which then becomes the card; so does an edit Telegram rejects. "Message
+    is not modified" means the screen is already up to date and is ignored.
+    """
+    if SINGLE_CARD_MODE and not new and (reply_markup is None or isinstance(reply_markup, InlineKeyboardMarkup)):
+        card = _card_target(update, context)
+        if card is not None:
+            try:
+                await context.bot.edit_message_text(text, chat_id=card[0], message_id=card[1],
+                                                    reply_markup=reply_markup, parse_mode=parse_mode)
+                CARD_RENDERS.inc("edited")
+                context.user_data['card'] = card
+                return
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    CARD_RENDERS.inc("unchanged")  # a double tap; the screen is already right
+                    context.user_data['card'] = card
+                    return
+                # Deleted or no longer editable: start a new card below
+                logger.info(f"Card {card[1]} not editable ({e}), sending a new one")
+    message = await update.effective_message.reply_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    CARD_RENDERS.inc("sent")
+    if SINGLE_CARD_MODE:
+        context.user_data['card'] = (message.chat_id, message.message_id)
+
+async def send_gallery(message):
+    """Send the logo and MEDIA_DIR images as one album, reusing cached file_ids."""
+    assets = gallery_assets()
+    if not assets:
+        return
+    for attempt in range(2):
+        file_ids = [file_id_cache.get(path, version) for path, version in assets]
+        media = [file_id or await asyncio.to_thread(photo_bytes, path)
+                 for (path, version), file_id in zip(assets, file_ids)]
+        try:
+            if len(media) == 1:
+                sent = [await message.reply_photo(media[0])]
+            else:
+                sent = await message.reply_media_group([InputMediaPhoto(item) for item in media])
+        except BadRequest as e:
+            if attempt or "file" not in str(e).lower() or not any(file_ids):
+                raise
+            logger.warning(f"Cached gallery file_id rejected ({e}), uploading again")
+            for path, _ in assets:
+                file_id_cache.forget(path)
+            continue
+        for (path, version), sent_message in zip(assets, sent):
+            file_id_cache.put(path, version, sent_message.photo[-1].file_id)
+        return
+
 # --- NAVIGATION ---
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.clear()
-    keyboard = [[InlineKeyboardButton("English 🇺🇸", callback_data='lang_en')],
-                [InlineKeyboardButton("አማርኛ 🇪🇹", callback_data='lang_am')]]
-    target = update.message if update.message else update.callback_query.message
-    await target.reply_text("🌿 Choose Language / ቋንቋ ይምረጡ:", reply_markup=InlineKeyboardMarkup(keyboard))
+    await render_card(update, context, "🌿 Choose Language / ቋንቋ ይምረጡ:", LANGUAGE_KB)
     return ConversationHandler.END
 
+@timed
 async def show_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, lang: str = None):
     if lang: 
         context.user_data['lang'] = lang
     else: 
         lang = context.user_data.get('lang', 'en')
 
-    btns = CONTENT[lang]['btns']
-    keyboard = [
-        [InlineKeyboardButton(btns[0], callback_data='info_care'), InlineKeyboardButton(btns[1], callback_data='info_decor')],
-        [InlineKeyboardButton(btns[2], callback_data='info_arrival'), InlineKeyboardButton(btns[3], callback_data='info_media')],
-        [InlineKeyboardButton(btns[5], callback_data='p_start'), InlineKeyboardButton(btns[6], callback_data='d_start')],
-        [InlineKeyboardButton(btns[4], callback_data='info_contact'), InlineKeyboardButton(CONTENT[lang]['change_lang'], callback_data='restart')]
-    ]
-    query = update.callback_query
-    if query:
-        await query.answer()
-        await query.message.reply_text(CONTENT[lang]['welcome'], reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
-    else:
-        await update.message.reply_text(CONTENT[lang]['welcome'], reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    if update.callback_query:
+        await update.callback_query.answer()
+    await render_card(update, context, CONTENT[lang]['welcome'], UI[lang]['menu'], 'Markdown')
 
+@timed
 async def info_pages(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     lang = context.user_data.get('lang', 'en')
     choice = query.data.replace('info_', '')
     text = CONTENT[lang].get(f'{choice}_text', "Information coming soon...")
-    back_btn = InlineKeyboardMarkup([[InlineKeyboardButton(CONTENT[lang]['back'], callback_data='menu')]])
-    await query.message.edit_text(text, reply_markup=back_btn, parse_mode='Markdown')
+    await query.message.edit_text(text, reply_markup=UI[lang]['menu_back'], parse_mode='Markdown')
+    if choice == 'media':
+        try:
+            await send_gallery(query.message)
+        except Exception as e:
+            logger.error(f"❌ Media gallery failed: {e!r}")
+
+# --- FORM ENGINE ---
+# A form is a list of fields, one ConversationHandler state each. Every state gets a
+# single FormStepHandler whose check is a set lookup for the field it waits on, and
+# one dispatcher per form stores the answer and asks the next field by index, so a
+# new field costs one spec line and no extra handler checks.
+TEXT_ANSWER = filters.UpdateType.MESSAGE & filters.TEXT & ~filters.COMMAND
+PHOTO_ANSWER = filters.UpdateType.MESSAGE & filters.PHOTO
+
+def localized(text, lang):
+    """Plain strings serve both languages; a dict holds one text per language."""
+    return text if isinstance(text, str) else text.get(lang, text['en'])
+
+class FormField:
+    """One question: the user_data key for its answer and the state that waits for it.
+
+    ``kind`` is "text", "choice" (``choices`` are rows of (label, callback_data)) or
+    "photo" (the largest size's file_id is stored). ``validator`` takes the typed text
+    and returns the value to store, or raises ValueError with the message to show.
+    ``handler`` is the agos_handler_seconds label for answering this question.
+    """
+
+    def __init__(self, key, state, handler, prompt, kind="text", choices=(), validator=None):
+        self.key = key
+        self.state = state
+        self.handler = handler
+        self.prompt = prompt
+        self.kind = kind
+        self.choices = choices
+        self.choice_data = frozenset(data for row in choices for _, data in row)
+        self.validator = validator
+
+
+class Form:
+    """Runs a ConversationHandler from a list of FormFields.
+
+    With ``back_data`` set, every question after the first gets a back button and the
+    answered states are kept in user_data['history']. ``on_complete`` runs once the
+    last answer is stored and returns the conversation's next state.
+    """
+
+    def __init__(self, fields, on_complete, back_data=None):
+        self.fields = fields
+        self.on_complete = on_complete
+        self.back_data = back_data
+        self.index = {field.state: i for i, field in enumerate(fields)}
+        self.keyboards = {(field.state, lang): self.keyboard(field, lang) for field in fields for lang in CONTENT}
+
+    def states(self):
+        return {field.state: [FormStepHandler(self, field)] for field in self.fields}
+
+    def keyboard(self, field, lang):
+        rows = [[InlineKeyboardButton(localized(label, lang), callback_data=data) for label, data in row]
+                for row in field.choices]
+        first = self.index[field.state] == 0
+        if self.back_data and not first:
+            rows.append([InlineKeyboardButton(CONTENT[lang]['q_back'], callback_data=self.back_data)])
+        if rows:
+            return InlineKeyboardMarkup(rows)
+        return ReplyKeyboardRemove() if first else None
+
+    async def ask(self, update, context, state):
+        field = self.fields[self.index[state]]
+        lang = context.user_data.get('lang', 'en')
+        await render_card(update, context, localized(field.prompt, lang), self.keyboards[state, lang])
+        return state
+
+    def accepts(self, field, update):
+        query = update.callback_query
+        if query is not None:
+            return query.data in field.choice_data or (self.back_data is not None and query.data == self.back_data)
+        if field.kind == "text":
+            return bool(TEXT_ANSWER.check_update(update))
+        if field.kind == "photo":
+            return bool(PHOTO_ANSWER.check_update(update))
+        return False
+
+    async def dispatch(self, update, context, field):
+        query = update.callback_query
+        if query is not None and query.data == self.back_data:
+            return await self.back(update, context)
+        started = time.perf_counter()
+        try:
+            return await self.answer(update, context, field)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, field.handler)
+
+    async def answer(self, update, context, field):
+        if update.callback_query is not None:
+            await update.callback_query.answer()
+            value = update.callback_query.data
+        elif field.kind == "photo":
+            value = update.message.photo[-1].file_id
+        else:
+            value = update.message.text
+            if field.validator is not None:
+                try:
+                    value = field.validator(value)
+                except ValueError as e:
+                    await update.message.reply_text(str(e))
+                    return None  # stay on this question
+        context.user_data[field.key] = value
+        if self.back_data:
+            context.user_data.setdefault('history', []).append(field.state)
+        following = self.index[field.state] + 1
+        if following == len(self.fields):
+            return await self.on_complete(update, context)
+        return await self.ask(update, context, self.fields[following].state)
+
+    async def back(self, update, context):
+        await update.callback_query.answer()
+        history = context.user_data.get('history', [])
+        if not history:
+            return await start(update, context)
+        return await self.ask(update, context, history.pop())
+
+
+class FormStepHandler(BaseHandler):
+    """The only handler of a form state; passes its answers to Form.dispatch."""
+
+    def __init__(self, form, field):
+        super().__init__(form.dispatch)
+        self.form = form
+        self.field = field
+
+    def check_update(self, update):
+        return isinstance(update, Update) and self.form.accepts(self.field, update)
+
+    async def handle_update(self, update, application, check_result, context):
+        return await self.form.dispatch(update, context, self.field)
+
+
+async def stale_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Last handler for buttons: a choice the current question does not accept, or one
+    from an old message. Answered so the client stops its loading spinner."""
+    lang = context.user_data.get('lang', 'en')
+    await update.callback_query.answer(CONTENT[lang]['stale_button'], show_alert=True)
+
 
 # --- INTAKE FLOW ---
 async def p_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     lang = context.user_data.get('lang', 'en')
     context.user_data['history'] = []
-    kb = [
-        [InlineKeyboardButton(CONTENT[lang]['agree_btn'], callback_data='p_agree')],
-        [InlineKeyboardButton(CONTENT[lang]['back'], callback_data='menu')]
-    ]
-    await send_terms(update, TERMS_EN if lang == 'en' else TERMS_AM, InlineKeyboardMarkup(kb))
+    await send_terms(update, lang)
     return P_TERMS
 
-async def p_back_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    history = context.user_data.get('history', [])
-    if not history: 
-        return await start(update, context)
-    last_state = history.pop()
-    state_to_func = {
-        P_NAME: p_q1, P_ADDR: p_q2, P_AGE: p_q3, P_PHONE: p_q4, P_EDD: p_q5,
-        P_W_BEFORE: p_q6, P_W_NOW: p_q7, P_BIRTH: p_q8, P_GENDER: p_q9,
-        P_DIET: p_q10, P_RISK: p_q11, P_ALLERGY: p_q12, P_BREASTFEED: p_q13,
-        P_LANG_PREF: p_q14, P_NOTES: p_q15, P_HOME: p_q16, P_PACKAGE: p_q17, P_ID: p_q18
-    }
-    return await state_to_func[last_state](update, context)
-
+@timed
 async def p_q1(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    target = update.callback_query.message if update.callback_query else update.message
-    await target.reply_text("1. Full Name / ሙሉ ስም:", reply_markup=ReplyKeyboardRemove())
-    return P_NAME
-
-async def p_q2(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_name'] = update.message.text
-        context.user_data['history'].append(P_NAME)
-    await (update.message or update.callback_query.message).reply_text("2. Address / አድራሻ:", reply_markup=get_back_kb(lang))
-    return P_ADDR
-
-async def p_q3(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_addr'] = update.message.text
-        context.user_data['history'].append(P_ADDR)
-    await (update.message or update.callback_query.message).reply_text("3. Age / እድሜ:", reply_markup=get_back_kb(lang))
-    return P_AGE
-
-async def p_q4(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_age'] = update.message.text
-        context.user_data['history'].append(P_AGE)
-    await (update.message or update.callback_query.message).reply_text("4. Phone Number / ስልክ:", reply_markup=get_back_kb(lang))
-    return P_PHONE
-
-async def p_q5(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_phone'] = update.message.text
-        context.user_data['history'].append(P_PHONE)
-    await (update.message or update.callback_query.message).reply_text("5. Expected Due Date (EDD):\nFormat: (dd/mm/yyyy)\nExample: 12/10/2016 \n\n5. የሚጠበቅበት የወሊድ ቀን:\nአጻጻፍ: (ቀን/ወር/ዓመት)\nምሳሌ: 12/10/2016", reply_markup=get_back_kb(lang))
-    return P_EDD
-
-async def p_q6(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_edd'] = update.message.text
-        context.user_data['history'].append(P_EDD)
-    await (update.message or update.callback_query.message).reply_text("6. Weight Before Pregnancy (Kg): / ከእርግዝና በፊት ክብደት (ኪግ):", reply_markup=get_back_kb(lang))
-    return P_W_BEFORE
-
-async def p_q7(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_w_b'] = update.message.text
-        context.user_data['history'].append(P_W_BEFORE)
-    await (update.message or update.callback_query.message).reply_text("7. Current Weight (Kg): / አሁን ያለው ክብደት (ኪግ):", reply_markup=get_back_kb(lang))
-    return P_W_NOW
-
-async def p_q8(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_w_n'] = update.message.text
-        context.user_data['history'].append(P_W_NOW)
-    kb = [[InlineKeyboardButton("Normal / መደበኛ", callback_data='Normal'), InlineKeyboardButton("Cesarean / ቀዶ ሕክምና", callback_data='C-Sec')],
-          [InlineKeyboardButton(CONTENT[lang]['q_back'], callback_data='p_back')]]
-    await (update.message or update.callback_query.message).reply_text("8. Delivery Type / የወሊድ አይነት:", reply_markup=InlineKeyboardMarkup(kb))
-    return P_BIRTH
-
-async def p_q9(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.callback_query and update.callback_query.data != 'p_back':
-        context.user_data['p_birth'] = update.callback_query.data
-        context.user_data['history'].append(P_BIRTH)
-    kb = [[InlineKeyboardButton("Male / ወንድ", callback_data='M'), InlineKeyboardButton("Female / ሴት", callback_data='F')],
-          [InlineKeyboardButton(CONTENT[lang]['q_back'], callback_data='p_back')]]
-    await (update.message or update.callback_query.message).reply_text("9. Baby Gender / የሕፃኑ ጾታ:", reply_markup=InlineKeyboardMarkup(kb))
-    return P_GENDER
-
-async def p_q10(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.callback_query and update.callback_query.data != 'p_back':
-        context.user_data['p_gender'] = update.callback_query.data
-        context.user_data['history'].append(P_GENDER)
-    await (update.message or update.callback_query.message).reply_text("10. Dietary Preference / የምግብ ምርጫ ወይም ክልከላ:", reply_markup=get_back_kb(lang))
-    return P_DIET
-
-async def p_q11(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_diet'] = update.message.text
-        context.user_data['history'].append(P_DIET)
-    await (update.message or update.callback_query.message).reply_text("11. Pregnancy Complications / በእርግዝና ወቅት ያጋጠመ የጤና ችግር፦", reply_markup=get_back_kb(lang))
-    return P_RISK
-
-async def p_q12(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_risk'] = update.message.text
-        context.user_data['history'].append(P_RISK)
-    await (update.message or update.callback_query.message).reply_text("12. Allergies / አለርጂ ያለብዎ ነገር:", reply_markup=get_back_kb(lang))
-    return P_ALLERGY
-
-async def p_q13(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_allergy'] = update.message.text
-        context.user_data['history'].append(P_ALLERGY)
-    kb = [[InlineKeyboardButton("Yes", callback_data='Yes'), InlineKeyboardButton("No", callback_data='No')],
-          [InlineKeyboardButton(CONTENT[lang]['q_back'], callback_data='p_back')]]
-    await (update.message or update.callback_query.message).reply_text("13. Breastfeeding? / ጡት እያጠቡ ነው?:", reply_markup=InlineKeyboardMarkup(kb))
-    return P_BREASTFEED
-
-async def p_q14(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.callback_query and update.callback_query.data != 'p_back':
-        context.user_data['p_breast'] = update.callback_query.data
-        context.user_data['history'].append(P_BREASTFEED)
-    await (update.message or update.callback_query.message).reply_text("14. Preferred Language / የሚመርጡት ቋንቋ:", reply_markup=get_back_kb(lang))
-    return P_LANG_PREF
-
-async def p_q15(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_lang'] = update.message.text
-        context.user_data['history'].append(P_LANG_PREF)
-    await (update.message or update.callback_query.message).reply_text("15. Additional Notes / ተጨማሪ አስተያየት፦:", reply_markup=get_back_kb(lang))
-    return P_NOTES
-
-async def p_q16(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.message:
-        context.user_data['p_notes'] = update.message.text
-        context.user_data['history'].append(P_NOTES)
-    kb = [[InlineKeyboardButton("Villa / ቪላ", callback_data='Villa'), InlineKeyboardButton("Apartment / አፓርትመንት", callback_data='Apartment')],
-          [InlineKeyboardButton(CONTENT[lang]['q_back'], callback_data='p_back')]]
-    await (update.message or update.callback_query.message).reply_text("16. House Type / የቤት አይነት:", reply_markup=InlineKeyboardMarkup(kb))
-    return P_HOME
-
-async def p_q17(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.callback_query and update.callback_query.data != 'p_back':
-        context.user_data['p_home'] = update.callback_query.data
-        context.user_data['history'].append(P_HOME)
-    kb = [[InlineKeyboardButton("Full 40 / ሙሉ 40 ቀን", callback_data='Full40'), InlineKeyboardButton("Half 30 / ግማሽ 30 ቀን", callback_data='Half30')],
-          [InlineKeyboardButton(CONTENT[lang]['q_back'], callback_data='p_back')]]
-    await (update.message or update.callback_query.message).reply_text("17. Package Selection / የፓኬጅ ምርጫ:", reply_markup=InlineKeyboardMarkup(kb))
-    return P_PACKAGE
-
-async def p_q18(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    lang = context.user_data.get('lang', 'en')
-    if update.callback_query and update.callback_query.data != 'p_back':
-        context.user_data['p_pkg'] = update.callback_query.data
-        context.user_data['history'].append(P_PACKAGE)
-    await (update.message or update.callback_query.message).reply_text("18. Upload National ID Photo / የመታወቂያ ፎቶ ይላኩ:", reply_markup=get_back_kb(lang))
-    return P_ID
+    return await intake_form.ask(update, context, P_NAME)
+
+# Handler labels keep the names of the per-question coroutines this table replaced
+INTAKE_FIELDS = [
+    FormField('p_name', P_NAME, "p_q2", "1. Full Name / ሙሉ ስም:"),
+    FormField('p_addr', P_ADDR, "p_q3", "2. Address / አድራሻ:"),
+    FormField('p_age', P_AGE, "p_q4", "3. Age / እድሜ:"),
+    FormField('p_phone', P_PHONE, "p_q5", "4. Phone Number / ስልክ:"),
+    FormField('p_edd', P_EDD, "p_q6", "5. Expected Due Date (EDD):\nFormat: (dd/mm/yyyy)\nExample: 12/10/2016 \n\n5. የሚጠበቅበት የወሊድ ቀን:\nአጻጻፍ: (ቀን/ወር/ዓመት)\nምሳሌ: 12/10/2016"),
+    FormField('p_w_b', P_W_BEFORE, "p_q7", "6. Weight Before Pregnancy (Kg): / ከእርግዝና በፊት ክብደት (ኪግ):"),
+    FormField('p_w_n', P_W_NOW, "p_q8", "7. Current Weight (Kg): / አሁን ያለው ክብደት (ኪግ):"),
+    FormField('p_birth', P_BIRTH, "p_q9", "8. Delivery Type / የወሊድ አይነት:", "choice",
+              [[("Normal / መደበኛ", 'Normal'), ("Cesarean / ቀዶ ሕክምና", 'C-Sec')]]),
+    FormField('p_gender', P_GENDER, "p_q10", "9. Baby Gender / የሕፃኑ ጾታ:", "choice",
+              [[("Male / ወንድ", 'M'), ("Female / ሴት", 'F')]]),
+    FormField('p_diet', P_DIET, "p_q11", "10. Dietary Preference / የምግብ ምርጫ ወይም ክልከላ:"),
+    FormField('p_risk', P_RISK, "p_q12", "11. Pregnancy Complications / በእርግዝና ወቅት ያጋጠመ የጤና ችግር፦"),
+    FormField('p_allergy', P_ALLERGY, "p_q13", "12. Allergies / አለርጂ ያለብዎ ነገር:"),
+    FormField('p_breast', P_BREASTFEED, "p_q14", "13. Breastfeeding? / ጡት እያጠቡ ነው?:", "choice",
+              [[("Yes", 'Yes'), ("No", 'No')]]),
+    FormField('p_lang', P_LANG_PREF, "p_q15", "14. Preferred Language / የሚመርጡት ቋንቋ:"),
+    FormField('p_notes', P_NOTES, "p_q16", "15. Additional Notes / ተጨማሪ አስተያየት፦:"),
+    FormField('p_home', P_HOME, "p_q17", "16. House Type / የቤት አይነት:", "choice",
+              [[("Villa / ቪላ", 'Villa'), ("Apartment / አፓርትመንት", 'Apartment')]]),
+    FormField('p_pkg', P_PACKAGE, "p_q18", "17. Package Selection / የፓኬጅ ምርጫ:", "choice",
+              [[("Full 40 / ሙሉ 40 ቀን", 'Full40'), ("Half 30 / ግማሽ 30 ቀን", 'Half30')]]),
+    FormField('p_id_file', P_ID, "p_final", "18. Upload National ID Photo / የመታወቂያ ፎቶ ይላኩ:", "photo"),
+]
 
 async def p_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message.photo: 
-        return P_ID
-    
-    id_img = update.message.photo[-1].file_id
-    pdf_file = create_intake_pdf(context.user_data)
+    id_img = context.user_data['p_id_file']
+    try:
+        pdf_file = await pdf_renderer.render(context.user_data)
+    except Exception as e:
+        logger.error(f"❌ Intake PDF failed, submitting without it: {e!r}")
+        pdf_file = None
 
     report_lines = []
     for k, v in context.user_data.items():
@@ -717,98 +1153,58 @@ async def p_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     report = "🚨 **NEW INTAKE / አዲስ ምዝገባ** 🚨\n\n" + "\n".join(report_lines)
 
-    await context.bot.send_photo(chat_id=ADMIN_ID, photo=id_img, caption=f"🪪 ID ATTACHED / መታወቂያ ተያይዟል\n\n{report}", parse_mode='Markdown')
-    await context.bot.send_document(chat_id=ADMIN_ID, document=pdf_file, filename=f"Intake_{context.user_data.get('p_name','Agos')}.pdf")
-
-    pdf_file.seek(0)
-    await update.message.reply_document(document=pdf_file, filename="Agos_Intake_Confirmation.pdf", caption="✅ Application submitted! Above is your receipt. / ✅ ማመልከቻዎ ተልኳል! ከላይ ያለው ደረሰኝዎ ነው።")
-
     lang = context.user_data.get('lang', 'en')
-    btns = CONTENT[lang]['btns']
-    keyboard = [
-        [InlineKeyboardButton(btns[0], callback_data='info_care'), InlineKeyboardButton(btns[1], callback_data='info_decor')],
-        [InlineKeyboardButton(btns[2], callback_data='info_arrival'), InlineKeyboardButton(btns[3], callback_data='info_media')],
-        [InlineKeyboardButton(btns[5], callback_data='p_start'), InlineKeyboardButton(btns[6], callback_data='d_start')],
-        [InlineKeyboardButton(btns[4], callback_data='info_contact'), InlineKeyboardButton(CONTENT[lang]['change_lang'], callback_data='restart')]
-    ]
-    
-    await update.message.reply_text(CONTENT[lang]['welcome'], reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+    id_caption = f"🪪 ID ATTACHED / መታወቂያ ተያይዟል\n\n{report}"
+    admin_photo = ("send_photo", {"chat_id": ADMIN_ID, "photo": id_img, "caption": id_caption, "parse_mode": 'Markdown'})
+
+    # Journal and record the booking before any upload that could fail
+    admin_outbox.enqueue(admin_photo)
+    submission_id = record_submission("intake", update, context, id_img)
+    if pdf_file is None:
+        await update.message.reply_text("✅ Application submitted! / ✅ ማመልከቻዎ ተልኳል!")
+    else:
+        # Upload once to the user, then hand the admin the same file by file_id
+        receipt = await update.message.reply_document(document=pdf_file, filename="Agos_Intake_Confirmation.pdf", caption="✅ Application submitted! Above is your receipt. / ✅ ማመልከቻዎ ተልኳል! ከላይ ያለው ደረሰኝዎ ነው።")
+        admin_outbox.enqueue(
+            ("send_document", {"chat_id": ADMIN_ID, "document": receipt.document.file_id,
+                               "caption": f"📄 Intake_{context.user_data.get('p_name','Agos')}"}))
+        attach_submission_pdf(submission_id, receipt.document.file_id)
+    await render_card(update, context, CONTENT[lang]['welcome'], UI[lang]['menu'], 'Markdown', new=True)
     return ConversationHandler.END
 
+intake_form = Form(INTAKE_FIELDS, p_final, back_data='p_back')
+
 # --- DECOR FLOW ---
 async def d_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     lang = context.user_data.get('lang', 'en')
     await query.answer()
-    kb = [[InlineKeyboardButton(CONTENT[lang]['back'], callback_data='menu')]]
-    await query.message.reply_text("🎁 **Decor Booking / ዲኮር ለማዘዝ **\n\n1. Full Name / ሙሉ ስም:", reply_markup=InlineKeyboardMarkup(kb))
+    await render_card(update, context, "🎁 **Decor Booking / ዲኮር ለማዘዝ **\n\n1. Full Name / ሙሉ ስም:", UI[lang]['menu_back'])
     return D_NAME
 
-async def d_step1(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['d_name'] = update.message.text
-    kb = [[InlineKeyboardButton("Male / ወንድ", callback_data='Male'), InlineKeyboardButton("Female / ሴት", callback_data='Female')],
-          [InlineKeyboardButton("Not Sure / እርግጠኛ አይደለሁም", callback_data='NotSure')]]
-    await update.message.reply_text("2. Gender of the Newborn / የአራሱ ጾታ:", reply_markup=InlineKeyboardMarkup(kb))
-    return D_GENDER
-
-async def d_step2(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    context.user_data['d_gender'] = query.data
-    await query.message.reply_text("3. House Address for Decor Setup / ዲኮር ለመስራት የቤት አድራሻ:")
-    return D_ADDR
-
-async def d_step3(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['d_addr'] = update.message.text
-    await update.message.reply_text("4. Client Phone Number / የደንበኛ ስልክ ቁጥር:")
-    return D_PHONE
-
-async def d_step4(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['d_phone'] = update.message.text
-    await update.message.reply_text("5. Contact Person at Home (if different) / በቤት ውስጥ የሚገኝ የደንበኛ ተወካይ (ከላይ ከተጠቀሰው ሲለይ):")
-    return D_CONTACT
-
-async def d_step5(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['d_contact'] = update.message.text
-    kb = [[InlineKeyboardButton("Home Decor - 15,000 ETB / መደበኛ ዲኮር - 15,000 ብር", callback_data='15k')],
-          [InlineKeyboardButton("Home Decor Deluxe - 20,000 ETB / ደልክስ ዲኮር - 20,000 ብር", callback_data='20k')],
-          [InlineKeyboardButton("Home Decor Premium - 25,000 ETB / ፕሪሚየም ዲኮር - 25,000 ብር", callback_data='25k')]]
-    await update.message.reply_text("6. Chosen Surprise Package / የተመረጠ የዲኮር ፓኬጅ:", reply_markup=InlineKeyboardMarkup(kb))
-    return D_PKG
-
-async def d_step6(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    context.user_data['d_pkg'] = query.data
-    await query.message.reply_text("7. Preferred Decor Date & Time\nFormat: (dd/mm/yyyy), (Time in LT)\nExample: 12/10/2016, 8:00 LT\n\n7. የሚፈለግ የዲኮር ቀን እና ሰዓት\nቅርጸት: (ቀን/ወር/ዓመት), (ሰዓት)\nለምሳሌ: 12/10/2016, 8:00")
-    return D_DATE
-
-async def d_step7(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['d_date'] = update.message.text
-    kb = [[InlineKeyboardButton("Villa / ቪላ", callback_data='Villa'), InlineKeyboardButton("Apartment / አፓርትመንት", callback_data='Apartment')],
-          [InlineKeyboardButton("Condominium / ኮንዶሚየም", callback_data='Condominium')],
-          [InlineKeyboardButton("G+1", callback_data='G1'), InlineKeyboardButton("G+2", callback_data='G2')]]
-    await update.message.reply_text("8. House Type / የቤት አይነት:", reply_markup=InlineKeyboardMarkup(kb))
-    return D_HOUSE
-
-async def d_step8(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    context.user_data['d_house'] = query.data
-    await query.message.reply_text("9. Special Notes (Limousine, Photo, Video, or None) / ልዩ ማስታወሻ (ሊሙዚን፣ ፎቶ፣ ቪዲዮ፣ ወይም ምንም):")
-    return D_NOTES
-
-async def d_step9(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data['d_notes'] = update.message.text
-    await update.message.reply_text("10. Finally, upload your Payment Screenshot / በመጨረሻም፣ የክፍያ ስክሪን ሾት ይላኩ:")
-    return D_PAYMENT
+DECOR_FIELDS = [
+    FormField('d_name', D_NAME, "d_step1", "🎁 **Decor Booking / ዲኮር ለማዘዝ **\n\n1. Full Name / ሙሉ ስም:"),
+    FormField('d_gender', D_GENDER, "d_step2", "2. Gender of the Newborn / የአራሱ ጾታ:", "choice",
+              [[("Male / ወንድ", 'Male'), ("Female / ሴት", 'Female')],
+               [("Not Sure / እርግጠኛ አይደለሁም", 'NotSure')]]),
+    FormField('d_addr', D_ADDR, "d_step3", "3. House Address for Decor Setup / ዲኮር ለመስራት የቤት አድራሻ:"),
+    FormField('d_phone', D_PHONE, "d_step4", "4. Client Phone Number / የደንበኛ ስልክ ቁጥር:"),
+    FormField('d_contact', D_CONTACT, "d_step5", "5. Contact Person at Home (if different) / በቤት ውስጥ የሚገኝ የደንበኛ ተወካይ (ከላይ ከተጠቀሰው ሲለይ):"),
+    FormField('d_pkg', D_PKG, "d_step6", "6. Chosen Surprise Package / የተመረጠ የዲኮር ፓኬጅ:", "choice",
+              [[("Home Decor - 15,000 ETB / መደበኛ ዲኮር - 15,000 ብር", '15k')],
+               [("Home Decor Deluxe - 20,000 ETB / ደልክስ ዲኮር - 20,000 ብር", '20k')],
+               [("Home Decor Premium - 25,000 ETB / ፕሪሚየም ዲኮር - 25,000 ብር", '25k')]]),
+    FormField('d_date', D_DATE, "d_step7", "7. Preferred Decor Date & Time\nFormat: (dd/mm/yyyy), (Time in LT)\nExample: 12/10/2016, 8:00 LT\n\n7. የሚፈለግ የዲኮር ቀን እና ሰዓት\nቅርጸት: (ቀን/ወር/ዓመት), (ሰዓት)\nለምሳሌ: 12/10/2016, 8:00"),
+    FormField('d_house', D_HOUSE, "d_step8", "8. House Type / የቤት አይነት:", "choice",
+              [[("Villa / ቪላ", 'Villa'), ("Apartment / አፓርትመንት", 'Apartment')],
+               [("Condominium / ኮንዶሚየም", 'Condominium')],
+               [("G+1", 'G1'), ("G+2", 'G2')]]),
+    FormField('d_notes', D_NOTES, "d_step9", "9. Special Notes (Limousine, Photo, Video, or None) / ልዩ ማስታወሻ (ሊሙዚን፣ ፎቶ፣ ቪዲዮ፣ ወይም ምንም):"),
+    FormField('d_payment_file', D_PAYMENT, "d_final", "10. Finally, upload your Payment Screenshot / በመጨረሻም፣ የክፍያ ስክሪን ሾት ይላኩ:", "photo"),
+]
 
 async def d_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if not update.message.photo:
-        await update.message.reply_text("Please upload a photo. / እባክዎ ፎቶ ይላኩ።")
-        return D_PAYMENT
-
-    pay_img = update.message.photo[-1].file_id
+    pay_img = context.user_data['d_payment_file']
     summary = (f"🔔 **NEW AGOS DECOR BOOKING / አዲስ የዲኮር ትዕዛዝ** 🔔\n\n"
                f"👤 Name / ስም: {context.user_data.get('d_name')}\n"
                f"👶 Baby Gender / የሕፃኑ ጾታ: {context.user_data.get('d_gender')}\n"
@@ -819,71 +1215,1084 @@ async def d_final(update: Update, context: ContextTypes.DEFAULT_TYPE):
                f"📅 Date / ቀን: {context.user_data.get('d_date')}\n"
                f"📝 Notes / ማስታወሻ: {context.user_data.get('d_notes')}")
 
-    await context.bot.send_photo(chat_id=ADMIN_ID, photo=pay_img, caption=summary, parse_mode='Markdown')
-    await update.message.reply_text("✅ Order Received! We will contact you shortly. / ✅ ትዕዛዝ ደርሷል! በቅርቡ እናገኝዎታለን።")
-    
     lang = context.user_data.get('lang', 'en')
-    btns = CONTENT[lang]['btns']
-    keyboard = [
-        [InlineKeyboardButton(btns[0], callback_data='info_care'), InlineKeyboardButton(btns[1], callback_data='info_decor')],
-        [InlineKeyboardButton(btns[2], callback_data='info_arrival'), InlineKeyboardButton(btns[3], callback_data='info_media')],
-        [InlineKeyboardButton(btns[5], callback_data='p_start'), InlineKeyboardButton(btns[6], callback_data='d_start')],
-        [InlineKeyboardButton(btns[4], callback_data='info_contact'), InlineKeyboardButton(CONTENT[lang]['change_lang'], callback_data='restart')]
-    ]
-    
-    await update.message.reply_text(CONTENT[lang]['welcome'], reply_markup=InlineKeyboardMarkup(keyboard), parse_mode='Markdown')
+
+    admin_outbox.enqueue(("send_photo", {"chat_id": ADMIN_ID, "photo": pay_img, "caption": summary, "parse_mode": 'Markdown'}))
+    record_submission("decor", update, context, pay_img)
+    await update.message.reply_text("✅ Order Received! We will contact you shortly. / ✅ ትዕዛዝ ደርሷል! በቅርቡ እናገኝዎታለን።")
+    await render_card(update, context, CONTENT[lang]['welcome'], UI[lang]['menu'], 'Markdown', new=True)
     return ConversationHandler.END
 
+decor_form = Form(DECOR_FIELDS, d_final)
+
+
+# --- LOCAL SQLITE STORAGE ---
+def open_sqlite(path):
+    """Open a SQLite database tuned for many short writes from several worker processes."""
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+# --- ADMIN NOTIFICATION OUTBOX ---
+class Outbox:
+    """Append-only SQLite journal of Bot API calls, delivered in batches by a background task.
+
+    Handlers only append rows, so a submission completes even when the admin chat is
+    unreachable. Rows are claimed with a short lease so several workers can share one
+    outbox file, and failed rows back off exponentially up to ``max_backoff`` seconds.
+    Rows for one chat are delivered strictly in journal order: a row waiting for a retry
+    (or in flight on another worker) holds back every later row of its chat, so only
+    transport errors, flood waits and server errors are retried; a request Telegram
+    rejects (bad file_id, caption too long, bot blocked) fails for good at once.
+    """
+
+    LEASE = 60
+    CAPTION_LIMIT = 1024
+
+    def __init__(self, path, batch_size, interval, max_backoff, max_attempts):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.db = open_sqlite(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, chat_id INTEGER, method TEXT NOT NULL, payload TEXT NOT NULL, "
+            "attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL, "
+            "claimed_until REAL NOT NULL DEFAULT 0, created_at REAL NOT NULL, "
+            "last_error TEXT, failed INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS outbox_pending ON outbox (failed, id);")
+        self.sent = 0
+        self._wakeup = None
+        self._task = None
+
+    def enqueue(self, *calls):
+        """Journal (method, kwargs) Bot API calls in order, in one transaction."""
+        now = time.time()
+        for _, kwargs in calls:
+            caption = kwargs.get("caption")
+            if caption and len(caption) > self.CAPTION_LIMIT:
+                kwargs["caption"] = caption[:self.CAPTION_LIMIT - 1] + "…"
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            self.db.executemany(
+                "INSERT INTO outbox (chat_id, method, payload, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+                [(kwargs.get("chat_id"), method, json.dumps(kwargs), now, now) for method, kwargs in calls])
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run(), name="outbox-flusher")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        try:
+            await self.flush()  # last attempt for anything already due
+        except Exception as e:
+            logger.warning(f"Outbox not fully drained on shutdown: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.drain()
+
+    async def drain(self):
+        """Flush batches until nothing due is left; errors are logged, rows stay journaled."""
+        try:
+            while await self.flush() == self.batch_size:
+                pass
+        except Exception as e:
+            logger.error(f"❌ Outbox flush failed: {e}", exc_info=True)
+
+    def _claim(self):
+        now = time.time()
+        claimed, blocked = [], set()
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            rows = self.db.execute(
+                "SELECT id, chat_id, method, payload, attempts, next_attempt_at, claimed_until "
+                "FROM outbox WHERE failed = 0 ORDER BY id LIMIT ?", (self.batch_size * 5,)).fetchall()
+            for row_id, chat_id, method, payload, attempts, next_attempt_at, claimed_until in rows:
+                if chat_id in blocked:
+                    continue
+                if next_attempt_at > now or claimed_until >= now:
+                    blocked.add(chat_id)
+                    continue
+                claimed.append((row_id, chat_id, method, payload, attempts))
+                if len(claimed) == self.batch_size:
+                    break
+            self.db.executemany("UPDATE outbox SET claimed_until = ? WHERE id = ?",
+                                [(now + self.LEASE, row[0]) for row in claimed])
+        return claimed
+
+    async def flush(self):
+        """Deliver one batch in journal order; returns how many rows were claimed."""
+        rows = self._claim()
+        blocked = set()
+        for row_id, chat_id, method, payload, attempts in rows:
+            if chat_id in blocked:
+                self.db.execute("UPDATE outbox SET claimed_until = 0 WHERE id = ?", (row_id,))
+                continue
+            try:
+                await self._send(method, json.loads(payload))
+            except Exception as e:
+                self._fail(row_id, attempts + 1, e)
+                blocked.add(chat_id)
+                continue
+            self.db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+            self.sent += 1
+        return len(rows)
+
+    async def _send(self, method, kwargs):
+        try:
+            await getattr(app.bot, method)(**kwargs)
+        except BadRequest as e:
+            # User-typed text can break Markdown captions; deliver it as plain text instead
+            if "parse" not in str(e).lower() or "parse_mode" not in kwargs:
+                raise
+            kwargs.pop("parse_mode")
+            await getattr(app.bot, method)(**kwargs)
+
+    @staticmethod
+    def _retryable(error):
+        # BadRequest subclasses NetworkError but will fail the same way every time
+        return isinstance(error, (RetryAfter, NetworkError)) and not isinstance(error, BadRequest)
+
+    def _fail(self, row_id, attempts, error):
+        retryable = self._retryable(error)
+        failed = attempts >= self.max_attempts or not retryable
+        delay = min(self.max_backoff, 2 ** attempts)
+        if isinstance(error, RetryAfter):
+            delay = max(delay, error.retry_after)
+        self.db.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, claimed_until = 0, "
+            "last_error = ?, failed = ? WHERE id = ?",
+            (attempts, time.time() + delay, repr(error), int(failed), row_id))
+        if not retryable:
+            logger.error(f"❌ Outbox row {row_id} rejected by Telegram, not retrying: {error!r}")
+        elif failed:
+            logger.error(f"❌ Outbox row {row_id} gave up after {attempts} attempts: {error!r}")
+        else:
+            logger.warning(f"⏳ Outbox row {row_id} failed ({error!r}), retrying in {delay:.0f}s")
+
+    def stats(self):
+        pending, failed = self.db.execute(
+            "SELECT COUNT(*) - COALESCE(SUM(failed), 0), COALESCE(SUM(failed), 0) FROM outbox").fetchone()
+        return {"pending": pending, "failed": failed, "sent": self.sent}
+
+
+admin_outbox = Outbox(OUTBOX_DB_PATH, OUTBOX_BATCH_SIZE, OUTBOX_FLUSH_INTERVAL,
+                      OUTBOX_MAX_BACKOFF, OUTBOX_MAX_ATTEMPTS)
+
+
+# --- TELEGRAM FILE ID CACHE ---
+FILE_ID_LOOKUPS = Counter("agos_file_id_cache_total", "Static media sends by whether a cached file_id was reused.",
+                          ("result",))
+MEDIA_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+MEDIA_GROUP_MAX = 10
+
+class FileIdCache:
+    """SQLite map from a static asset to the file_id Telegram gave it on first upload.
+
+    ``version`` identifies the asset's content (a digest, or a file's size and mtime),
+    so a changed asset is uploaded again instead of resending the old file_id. Lookups
+    are memoised per process; the table is shared by all workers.
+    """
+
+    def __init__(self, path):
+        self.db = open_sqlite(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS file_ids (asset TEXT PRIMARY KEY, version TEXT NOT NULL, "
+            "file_id TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._memory = {}
+
+    def get(self, asset, version):
+        if asset not in self._memory:
+            self._memory[asset] = self.db.execute(
+                "SELECT version, file_id FROM file_ids WHERE asset = ?", (asset,)).fetchone()
+        row = self._memory[asset]
+        hit = row is not None and row[0] == version
+        FILE_ID_LOOKUPS.inc("hit" if hit else "miss")
+        return row[1] if hit else None
+
+    def put(self, asset, version, file_id):
+        self._memory[asset] = (version, file_id)
+        self.db.execute("INSERT OR REPLACE INTO file_ids (asset, version, file_id, updated_at) VALUES (?, ?, ?, ?)",
+                        (asset, version, file_id, time.time()))
+
+    def forget(self, asset):
+        self._memory.pop(asset, None)
+        self.db.execute("DELETE FROM file_ids WHERE asset = ?", (asset,))
+
+    async def send(self, asset, version, send, load):
+        """Call ``send(file_id)``, or ``send(await load())`` on a miss, and remember the new file_id.
+
+        ``send`` returns the sent Message; a cached file_id that Telegram rejects is
+        dropped and the asset uploaded again.
+        """
+        file_id = self.get(asset, version)
+        if file_id is not None:
+            try:
+                return await send(file_id)
+            except BadRequest as e:
+                if "file" not in str(e).lower():
+                    raise
+                logger.warning(f"Cached file_id for {asset} rejected ({e}), uploading again")
+                self.forget(asset)
+        message = await send(await load())
+        attachment = message.document or message.photo[-1]
+        self.put(asset, version, attachment.file_id)
+        return message
+
+    def stats(self):
+        return {"cached": self.db.execute("SELECT COUNT(*) FROM file_ids").fetchone()[0]}
+
+
+file_id_cache = FileIdCache(FILE_ID_CACHE_PATH)
+
+def gallery_assets():
+    """(path, version) of the logo plus the MEDIA_DIR images; empty without gallery images."""
+    if not os.path.isdir(MEDIA_DIR):
+        return []
+    paths = sorted(os.path.join(MEDIA_DIR, name) for name in os.listdir(MEDIA_DIR)
+                   if name.lower().endswith(MEDIA_EXTENSIONS))
+    if not paths:
+        return []
+    if os.path.exists(LOGO_PATH):
+        paths.insert(0, LOGO_PATH)
+    assets = []
+    for path in paths[:MEDIA_GROUP_MAX]:
+        st = os.stat(path)
+        assets.append((path, f"{st.st_size}:{st.st_mtime_ns}"))
+    return assets
+
+def photo_bytes(path):
+    """File contents for sendPhoto; anything but JPEG and PNG (the .webp logo) is converted to PNG."""
+    if path.lower().endswith((".jpg", ".jpeg", ".png")):
+        with open(path, "rb") as f:
+            return f.read()
+    buffer = BytesIO()
+    flatten_image(path).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+# --- SUBMISSION STORE ---
+_DATE_RE = re.compile(r"(\d{1,2})\s*[/.-]\s*(\d{1,2})\s*[/.-]\s*(\d{4})")
+
+def parse_form_date(text):
+    """Best-effort ISO date for a typed dd/mm/yyyy answer; Ethiopian-calendar years are converted."""
+    match = _DATE_RE.search(text or "")
+    if not match:
+        return None
+    day, month, year = (int(g) for g in match.groups())
+    try:
+        if year < date.today().year - 4:
+            # Ethiopian calendar (the form examples use it): 13 months, 12 of 30 days
+            if not (1 <= month <= 13 and 1 <= day <= 30):
+                return None
+            ordinal = 365 * (year - 1) + year // 4 + 30 * (month - 1) + day + 2795
+            return date.fromordinal(ordinal).isoformat()
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+PHONE_MAX_DIGITS = 15  # E.164; also keeps "adm:f:<key>:<cursor>" within the 64-byte callback_data limit
+
+def phone_key(phone):
+    """Digits-only phone for lookups, with +251/0 prefixes folded to the local 9-digit number."""
+    digits = re.sub(r"\D", "", phone or "")
+    if digits.startswith("251"):
+        digits = digits[3:]
+    return digits.lstrip("0") or None
+
+
+class SubmissionStore:
+    """Indexed SQLite record of every completed intake and decor booking."""
+
+    COLUMNS = "id, kind, chat_id, created_at, name, phone, event_date, event_day, package, photo_file_id, pdf_file_id, data"
+
+    def __init__(self, path):
+        self.path = path
+        self.db = open_sqlite(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS submissions ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, kind TEXT NOT NULL, chat_id INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, name TEXT, phone TEXT, phone_key TEXT, event_date TEXT, "
+            "event_day TEXT, package TEXT, photo_file_id TEXT, pdf_file_id TEXT, data TEXT NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS submissions_phone ON submissions (phone_key, id);"
+            "CREATE INDEX IF NOT EXISTS submissions_name ON submissions (name COLLATE NOCASE, id);"
+            "CREATE INDEX IF NOT EXISTS submissions_day ON submissions (event_day, id);"
+            "CREATE INDEX IF NOT EXISTS submissions_package ON submissions (package, id);"
+            "CREATE INDEX IF NOT EXISTS submissions_kind ON submissions (kind, id);"
+            "CREATE INDEX IF NOT EXISTS submissions_created ON submissions (created_at);")
+
+    def add(self, kind, chat_id, user_data, photo_file_id=None, pdf_file_id=None):
+        prefix = "p_" if kind == "intake" else "d_"
+        fields = {k: v for k, v in user_data.items() if k.startswith(prefix) and not k.endswith('_file')}
+        event_date = fields.get(f"{prefix}edd" if kind == "intake" else "d_date")
+        cur = self.db.execute(
+            "INSERT INTO submissions (kind, chat_id, created_at, name, phone, phone_key, event_date, "
+            "event_day, package, photo_file_id, pdf_file_id, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, chat_id, time.time(), fields.get(f"{prefix}name"), fields.get(f"{prefix}phone"),
+             phone_key(fields.get(f"{prefix}phone")), event_date, parse_form_date(event_date),
+             fields.get(f"{prefix}pkg"), photo_file_id, pdf_file_id, json.dumps(fields, ensure_ascii=False)))
+        return cur.lastrowid
+
+    def set_pdf_file_id(self, submission_id, pdf_file_id):
+        self.db.execute("UPDATE submissions SET pdf_file_id = ? WHERE id = ?", (pdf_file_id, submission_id))
+
+    def _rows(self, where, params, limit, before_id=None, order="id DESC"):
+        # Keyset pagination: the next page starts below the last id shown, never an OFFSET scan
+        if before_id is not None:
+            where, params = f"{where} AND id < ?", (*params, before_id)
+        rows = self.db.execute(f"SELECT {self.COLUMNS} FROM submissions WHERE {where} ORDER BY {order} LIMIT ?",
+                               (*params, limit)).fetchall()
+        return [self._as_dict(row) for row in rows]
+
+    def _as_dict(self, row):
+        record = dict(zip([c.strip() for c in self.COLUMNS.split(",")], row))
+        record["data"] = json.loads(record["data"])
+        return record
+
+    def by_kind(self, kind, limit=20, before_id=None):
+        return self._rows("kind = ?", (kind,), limit, before_id)
+
+    def by_phone(self, phone, limit=20, before_id=None):
+        return self._rows("phone_key = ?", (phone_key(phone),), limit, before_id)
+
+    def by_name(self, name, limit=20, before_id=None):
+        return self._rows("name = ? COLLATE NOCASE", (name,), limit, before_id)
+
+    def by_package(self, package, limit=20, before_id=None):
+        return self._rows("package = ?", (package,), limit, before_id)
+
+    def between_days(self, first_day, last_day, limit=20, after=None):
+        """Soonest first; ``after`` is the (event_day, id) of the last row already shown."""
+        where, params = "event_day BETWEEN ? AND ?", (first_day, last_day)
+        if after is not None:
+            # Seek straight to the cursor's day in the (event_day, id) index
+            day, last_id = after
+            where, params = f"{where} AND (event_day > ? OR id > ?)", (max(first_day, day), last_day, day, last_id)
+        return self._rows(where, params, limit, order="event_day, id")
+
+    def stream(self, kind=None, package=None, since=None, until=None, batch=500):
+        """Yield raw rows oldest first, ``batch`` at a time, from a private read connection.
+
+        The bot keeps writing through ``self.db`` while an export runs; WAL gives the
+        reader a consistent snapshot without blocking it.
+        """
+        where, params = ["1"], []
+        for clause, value in (("kind = ?", kind), ("package = ?", package),
+                              ("created_at >= ?", since), ("created_at < ?", until)):
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        db = open_sqlite(self.path)
+        try:
+            cur = db.execute(f"SELECT {self.COLUMNS} FROM submissions WHERE {' AND '.join(where)} ORDER BY id",
+                             params)
+            while True:
+                rows = cur.fetchmany(batch)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            db.close()
+
+
+submission_store = SubmissionStore(SUBMISSIONS_DB_PATH)
+startup_mark("content, handlers and stores")
+
+def record_submission(kind, update, context, photo_file_id, pdf_file_id=None):
+    """Store a completed submission; never lets a storage error break the user's flow."""
+    try:
+        return submission_store.add(kind, update.effective_chat.id, context.user_data, photo_file_id, pdf_file_id)
+    except sqlite3.Error as e:
+        logger.error(f"❌ Could not record {kind} submission: {e}", exc_info=True)
+        return None
+
+def attach_submission_pdf(submission_id, pdf_file_id):
+    """Add the receipt's file_id to a submission recorded before the upload."""
+    if submission_id is None:
+        return
+    try:
+        submission_store.set_pdf_file_id(submission_id, pdf_file_id)
+    except sqlite3.Error as e:
+        logger.error(f"❌ Could not attach PDF to submission {submission_id}: {e}", exc_info=True)
+
+
+# --- ADMIN COMMANDS ---
+# /intakes, /decor, /find <phone> and /upcoming <days>, answered from the submission
+# index one page at a time. Page buttons carry the cursor in their callback data
+# ("adm:<listing>:<arg>:<cursor>") so every page is a single indexed range query.
+ADMIN_COMMANDS = {"intakes": "i", "decor": "d", "find": "f", "upcoming": "u"}
+
+def is_admin(update):
+    chat, user = update.effective_chat, update.effective_user
+    return (chat is not None and chat.id == ADMIN_ID) or (user is not None and user.id == ADMIN_ID)
+
+def _admin_line(record):
+    icon = "🤱" if record["kind"] == "intake" else "🎉"
+    name = (record["name"] or "-")[:40]
+    created = time.strftime("%d/%m/%Y", time.localtime(record["created_at"]))
+    return (f"{icon} #{record['id']} {name} · {record['phone'] or '-'}\n"
+            f"    📦 {(record['package'] or '-')[:40]} · 📅 {(record['event_date'] or '-')[:20]} · 🕒 {created}")
+
+def admin_page(listing, arg, cursor=None):
+    """Render one page of an admin listing as (text, reply_markup)."""
+    limit = ADMIN_PAGE_SIZE + 1  # one extra row tells us whether there is a next page
+    if listing == "u":
+        first_day = date.today()
+        last_day = first_day + timedelta(days=int(arg))
+        after = tuple(cursor.split("_")) if cursor else None
+        after = (after[0], int(after[1])) if after else None
+        title = f"📅 Upcoming dates ({first_day:%d/%m} - {last_day:%d/%m})"
+        records = submission_store.between_days(first_day.isoformat(), last_day.isoformat(), limit, after)
+    else:
+        before_id = int(cursor) if cursor else None
+        if listing == "i":
+            title, records = "🤱 Latest intakes", submission_store.by_kind("intake", limit, before_id)
+        elif listing == "d":
+            title, records = "🎉 Latest decor bookings", submission_store.by_kind("decor", limit, before_id)
+        else:
+            title, records = f"🔎 Phone ...{arg}", submission_store.by_phone(arg, limit, before_id)
+
+    has_next = len(records) > ADMIN_PAGE_SIZE
+    records = records[:ADMIN_PAGE_SIZE]
+    if not records:
+        return f"{title}\n\nNo records found.", None
+    text = f"{title}\n\n" + "\n".join(_admin_line(r) for r in records)
+
+    buttons = []
+    if cursor:
+        buttons.append(InlineKeyboardButton("⏮ First", callback_data=f"adm:{listing}:{arg}:"))
+    if has_next:
+        last = records[-1]
+        next_cursor = f"{last['event_day']}_{last['id']}" if listing == "u" else str(last["id"])
+        buttons.append(InlineKeyboardButton("Next ▶", callback_data=f"adm:{listing}:{arg}:{next_cursor}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not is_admin(update):
+        return
+    command = update.message.text.split()[0].lstrip("/").split("@")[0].lower()
+    listing, arg = ADMIN_COMMANDS[command], ""
+    if listing == "f":
+        arg = phone_key(" ".join(context.args))
+        if not arg or len(arg) > PHONE_MAX_DIGITS:
+            await update.message.reply_text(f"Usage: /find <phone> (at most {PHONE_MAX_DIGITS} digits)")
+            return
+    elif listing == "u":
+        arg = str(min(int(context.args[0]), 366)) if context.args and context.args[0].isdigit() else "7"
+    text, markup = admin_page(listing, arg)
+    await update.message.reply_text(text, reply_markup=markup)
+
+async def admin_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(update):
+        return
+    _, listing, arg, cursor = query.data.split(":", 3)
+    text, markup = admin_page(listing, arg, cursor or None)
+    await query.edit_message_text(text, reply_markup=markup)
+
+
+# --- SUBMISSION EXPORT ---
+# GET /export?format=csv|xlsx&from=YYYY-MM-DD&to=YYYY-MM-DD&package=...&kind=intake|decor
+# authenticated with ADMIN_API_TOKEN. Files are produced by generators that read the
+# store in batches and yield ~64 KB chunks, so memory stays flat whatever the size.
+EXPORT_HEADER = ("id", "kind", "submitted_at", "name", "phone", "event_date", "package",
+                 "photo_file_id", "pdf_file_id", "details")
+EXPORT_CHUNK = 64 * 1024
+_XML_ILLEGAL_RE = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def admin_authorized(auth_header, token_param):
+    if not ADMIN_API_TOKEN:
+        return False
+    supplied = token_param or ""
+    if auth_header and auth_header.startswith("Bearer "):
+        supplied = auth_header[7:]
+    return hmac.compare_digest(supplied.encode(), ADMIN_API_TOKEN.encode())
+
+def _export_values(row):
+    record = dict(zip([c.strip() for c in SubmissionStore.COLUMNS.split(",")], row))
+    submitted = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["created_at"]))
+    return (record["id"], record["kind"], submitted, record["name"], record["phone"], record["event_date"],
+            record["package"], record["photo_file_id"], record["pdf_file_id"], record["data"])
+
+def _csv_safe(value):
+    # Keep spreadsheet apps from evaluating user answers as formulas
+    if isinstance(value, str) and value[:1] in ("=", "+", "-", "@"):
+        return "'" + value
+    return value
+
+def export_csv(rows):
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")  # BOM so Excel opens Amharic text as UTF-8
+    writer.writerow(EXPORT_HEADER)
+    for row in rows:
+        writer.writerow([_csv_safe(v) for v in _export_values(row)])
+        if buffer.tell() >= EXPORT_CHUNK:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+class _ChunkSink:
+    """Write-only file object for zipfile; the generator drains what was written."""
+
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks, self.size = [], 0
+        return data
+
+_XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Submissions" sheetId="1" r:id="rId1"/></sheets></workbook>'),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'),
+}
+
+def _xlsx_row(values):
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append("<c/>")
+        elif isinstance(value, int):
+            cells.append(f"<c><v>{value}</v></c>")
+        else:
+            text = xml_escape(_XML_ILLEGAL_RE.sub("", str(value)))
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>"
+
+def export_xlsx(rows):
+    """Minimal single-sheet workbook with inline strings, zipped as it is generated."""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        for name, xml in _XLSX_PARTS.items():
+            archive.writestr(name, xml)
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            sheet.write(_xlsx_row(EXPORT_HEADER).encode("utf-8"))
+            for row in rows:
+                sheet.write(_xlsx_row(_export_values(row)).encode("utf-8"))
+                if sink.size >= EXPORT_CHUNK:
+                    yield sink.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv; charset=utf-8", export_csv),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", export_xlsx),
+}
+
+def build_export(args):
+    """Validate /export query arguments into (content_type, filename, chunk generator).
+
+    Raises ValueError with a message for the client on bad arguments.
+    """
+    fmt = args.get("format", "csv")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown format: {fmt}")
+    kind = args.get("kind") or None
+    if kind not in (None, "intake", "decor"):
+        raise ValueError(f"unknown kind: {kind}")
+    bounds = {}
+    for key, shift in (("from", 0), ("to", 1)):
+        if args.get(key):
+            try:
+                day = date.fromisoformat(args[key]) + timedelta(days=shift)  # "to" is inclusive
+            except ValueError:
+                raise ValueError(f"{key} must be YYYY-MM-DD")
+            bounds[key] = time.mktime(day.timetuple())
+    content_type, writer = EXPORT_FORMATS[fmt]
+    rows = submission_store.stream(kind=kind, package=args.get("package") or None,
+                                   since=bounds.get("from"), until=bounds.get("to"))
+    filename = f"agos_submissions_{date.today():%Y%m%d}.{fmt}"
+    return content_type, filename, writer(rows)
+
+
+# --- PERSISTENCE ---
+class SQLitePersistence(BasePersistence):
+    """Stores user_data and conversation states in SQLite so any worker can continue a flow.
+
+    Writes are write-behind: the Application hands over changed entries every
+    ``update_interval`` seconds and the whole batch is committed in one transaction.
+    Before each update the rows for that user are re-read if another worker wrote a
+    newer version, so a conversation survives hopping between workers.
+    """
+
+    def __init__(self, path, update_interval):
+        super().__init__(store_data=PersistenceInput(bot_data=False, chat_data=False,
+                                                     user_data=True, callback_data=False),
+                         update_interval=update_interval)
+        self.db = open_sqlite(path)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS user_data "
+            "(user_id INTEGER PRIMARY KEY, data TEXT NOT NULL, version REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS conversations "
+            "(name TEXT NOT NULL, key TEXT NOT NULL, state INTEGER, version REAL NOT NULL, "
+            "PRIMARY KEY (name, key));")
+        self._user_versions = {}
+        self._conv_versions = {}
+        self._pending_users = {}
+        self._pending_convs = {}
+        self._commit_scheduled = False
+
+    # Loading
+    async def get_user_data(self):
+        # Loaded lazily per user in refresh_user_data
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        rows = self.db.execute("SELECT key, state, version FROM conversations "
+                               "WHERE name = ? AND state IS NOT NULL", (name,)).fetchall()
+        for key, _, version in rows:
+            self._conv_versions[(name, key)] = version
+        return {tuple(json.loads(key)): state for key, state, _ in rows}
+
+    # Refreshing from other workers
+    async def refresh_user_data(self, user_id, user_data):
+        if user_id in self._pending_users:
+            return
+        row = self.db.execute("SELECT data, version FROM user_data WHERE user_id = ?",
+                              (user_id,)).fetchone()
+        if row and row[1] > self._user_versions.get(user_id, 0):
+            user_data.clear()
+            user_data.update(json.loads(row[0]))
+            self._user_versions[user_id] = row[1]
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    def load_conversation(self, name, key):
+        """Return (changed, state) for one conversation key if another worker moved it on."""
+        db_key = json.dumps(list(key))
+        if (name, db_key) in self._pending_convs:
+            return False, None
+        row = self.db.execute("SELECT state, version FROM conversations WHERE name = ? AND key = ?",
+                              (name, db_key)).fetchone()
+        if not row or row[1] <= self._conv_versions.get((name, db_key), 0):
+            return False, None
+        self._conv_versions[(name, db_key)] = row[1]
+        return True, row[0]
+
+    # Write-behind
+    async def update_user_data(self, user_id, data):
+        self._pending_users[user_id] = json.dumps(data)
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id):
+        self._pending_users[user_id] = None
+        self._schedule_commit()
+
+    async def update_conversation(self, name, key, new_state):
+        self._pending_convs[(name, json.dumps(list(key)))] = new_state
+        self._schedule_commit()
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    def _schedule_commit(self):
+        # All entries of one persistence run arrive in the same loop iteration; commit them together
+        if not self._commit_scheduled:
+            self._commit_scheduled = True
+            asyncio.get_running_loop().call_soon(self._commit)
+
+    def _commit(self):
+        self._commit_scheduled = False
+        users, self._pending_users = self._pending_users, {}
+        convs, self._pending_convs = self._pending_convs, {}
+        if not users and not convs:
+            return
+        version = time.time()
+        try:
+            with self.db:
+                self.db.execute("BEGIN IMMEDIATE")
+                for user_id, data in users.items():
+                    if data is None:
+                        self.db.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+                    else:
+                        self.db.execute("INSERT OR REPLACE INTO user_data VALUES (?, ?, ?)",
+                                        (user_id, data, version))
+                    self._user_versions[user_id] = version
+                for (name, key), state in convs.items():
+                    self.db.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?, ?)",
+                                    (name, key, state, version))
+                    self._conv_versions[(name, key)] = version
+        except sqlite3.Error as e:
+            logger.error(f"❌ Persistence commit failed, will retry: {e}")
+            for user_id, data in users.items():
+                self._pending_users.setdefault(user_id, data)
+            for key, state in convs.items():
+                self._pending_convs.setdefault(key, state)
+
+    async def flush(self):
+        self._commit()
+
+
+PERSISTENCE_BACKENDS = {"sqlite": lambda: SQLitePersistence(PERSISTENCE_PATH, PERSISTENCE_FLUSH_INTERVAL)}
+
+
+def build_persistence():
+    if not PERSISTENCE_BACKEND:
+        return None
+    if PERSISTENCE_BACKEND not in PERSISTENCE_BACKENDS:
+        raise ValueError(f"Unknown PERSISTENCE_BACKEND: {PERSISTENCE_BACKEND}")
+    logger.info(f"💾 Using {PERSISTENCE_BACKEND} persistence")
+    return PERSISTENCE_BACKENDS[PERSISTENCE_BACKEND]()
+
+
+async def refresh_conversations(update):
+    """Pull this user's conversation states written by other workers before handlers run."""
+    if persistence is None or not update.effective_chat or not update.effective_user:
+        return
+    key = (update.effective_chat.id, update.effective_user.id)
+    for conv in (p_conv, d_conv):
+        changed, state = persistence.load_conversation(conv.name, key)
+        if not changed:
+            continue
+        # ConversationHandler offers no public way to inject a state
+        if state is None:
+            conv._conversations.data.pop(key, None)
+        else:
+            conv._conversations.update_no_track({key: state})
+
+
+# --- UPDATE SCHEDULING ---
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates of different chats concurrently but updates of one chat strictly in order.
+
+    Each chat keeps a chain of futures: an update waits for the previous update of the
+    same chat before taking one of ``max_concurrency`` global slots, so a chat that is
+    waiting for its turn never blocks other chats.
+    """
+
+    def __init__(self, max_concurrency, max_pending=10000):
+        super().__init__(max_concurrent_updates=max_pending)
+        self.max_concurrency = max_concurrency
+        self._slots = None
+        self._tails = {}
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        chat = update.effective_chat if isinstance(update, Update) else None
+        chat_id = chat.id if chat else None
+        queued_at = time.monotonic()
+        previous = self._tails.get(chat_id)
+        done = asyncio.get_running_loop().create_future()
+        if chat_id is not None:
+            self._tails[chat_id] = done
+        try:
+            if previous is not None:
+                # wait() rather than awaiting the future: cancelling this update must
+                # not cancel the previous update's future
+                await asyncio.wait([previous])
+            waited = time.monotonic() - queued_at
+            self.waits += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            CHAT_QUEUE_WAIT_SECONDS.observe(waited)
+            async with self._slots:
+                await coroutine
+        finally:
+            if previous is not None and not previous.done():
+                # Cancelled while waiting: the next update still waits for the previous one
+                previous.add_done_callback(lambda _: done.done() or done.set_result(None))
+            elif not done.done():
+                done.set_result(None)
+            coroutine.close()  # no-op once awaited; frees it if cancelled before its turn
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active_chats": len(self._tails),
+            "chat_queue_waits": self.waits,
+            "chat_queue_wait_avg_ms": round(1000 * self.wait_total / self.waits, 3) if self.waits else 0.0,
+            "chat_queue_wait_max_ms": round(1000 * self.wait_max, 3),
+        }
+
+
+# --- TELEGRAM RATE LIMITING ---
+class TokenBucket:
+    """Token bucket where callers reserve a token up front and sleep off any debt."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class TokenBucketRateLimiter(BaseRateLimiter):
+    """Keeps outgoing Bot API calls under Telegram's flood limits and honours RetryAfter."""
+
+    def __init__(self, global_rate, chat_rate, chat_burst, group_rate, max_retries):
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.retries = 0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self.chat_buckets) > 10000:
+                now = time.monotonic()
+                self.chat_buckets = {k: b for k, b in self.chat_buckets.items() if not b.idle(now)}
+            is_group = not isinstance(chat_id, int) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.chat_rate, self.chat_burst)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire()
+            await self.global_bucket.acquire()
+            try:
+                return await self._call(endpoint, callback, args, kwargs)
+            except RetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"⏳ Flood limit on {endpoint}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
+    @staticmethod
+    async def _call(endpoint, callback, args, kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        finally:
+            TELEGRAM_API_SECONDS.observe(time.perf_counter() - started, endpoint)
+
+    def stats(self):
+        return {"chat_buckets": len(self.chat_buckets), "retry_after_retries": self.retries}
+
+
+# --- BOT API HTTP CLIENT ---
+BOT_API_CONNECTIONS = Counter("agos_bot_api_connections_total",
+                              "Bot API requests by whether they opened a new connection or reused one.",
+                              ("pool", "connection"))
+BOT_API_POOL_WAIT_SECONDS = Histogram("agos_bot_api_pool_wait_seconds",
+                                      "Time a Bot API request waited for a pooled connection.", ("pool",))
+BOT_API_POOL_TIMEOUTS = Counter("agos_bot_api_pool_timeouts_total",
+                                "Bot API requests dropped because no pooled connection freed up in time.",
+                                ("pool",))
+
+class PooledHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest with a keep-alive expiry and connection pool counters.
+
+    httpcore reports through the request's ``trace`` extension whether it opened a TCP
+    connection or went straight to sending on a pooled one; the time until that first
+    event is the time spent waiting for the pool.
+    """
+
+    def __init__(self, pool, pool_size, pool_timeout, keepalive_expiry):
+        self.pool = pool
+        self.keepalive_expiry = keepalive_expiry
+        self.opened = 0
+        self.reused = 0
+        self.pool_timeouts = 0
+        super().__init__(connection_pool_size=pool_size, pool_timeout=pool_timeout)
+
+    def _build_client(self):
+        limits = self._client_kwargs["limits"]
+        self._client_kwargs["limits"] = httpx.Limits(max_connections=limits.max_connections,
+                                                     max_keepalive_connections=limits.max_keepalive_connections,
+                                                     keepalive_expiry=self.keepalive_expiry)
+        return httpx.AsyncClient(**self._client_kwargs, event_hooks={"request": [self._trace_request]})
+
+    async def _trace_request(self, request):
+        queued_at = time.perf_counter()
+        seen = False
+
+        async def trace(event, info):
+            nonlocal seen
+            if seen or not event.endswith(".started"):
+                return
+            if event == "connection.connect_tcp.started":
+                self.opened += 1
+                connection = "new"
+            elif event.endswith(".send_request_headers.started"):
+                self.reused += 1
+                connection = "reused"
+            else:
+                return
+            seen = True
+            BOT_API_CONNECTIONS.inc(self.pool, connection)
+            BOT_API_POOL_WAIT_SECONDS.observe(time.perf_counter() - queued_at, self.pool)
+
+        request.extensions["trace"] = trace
+
+    async def do_request(self, *args, **kwargs):
+        try:
+            return await super().do_request(*args, **kwargs)
+        except TimedOut as e:
+            if isinstance(e.__cause__, httpx.PoolTimeout):
+                self.pool_timeouts += 1
+                BOT_API_POOL_TIMEOUTS.inc(self.pool)
+            raise
+
+    def stats(self):
+        return {"connections_opened": self.opened, "connections_reused": self.reused,
+                "pool_timeouts": self.pool_timeouts}
+
+
 # --- MAIN TELEGRAM APPLICATION ---
-app = Application.builder().token(TOKEN).build()
+persistence = build_persistence()
+rate_limiter = TokenBucketRateLimiter(TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST,
+                                      TELEGRAM_GROUP_RATE, TELEGRAM_MAX_RETRIES)
+update_processor = PerChatUpdateProcessor(UPDATE_MAX_CONCURRENCY)
+bot_request = PooledHTTPXRequest("send", BOT_POOL_SIZE, BOT_POOL_TIMEOUT, BOT_KEEPALIVE_EXPIRY)
+get_updates_request = PooledHTTPXRequest("get_updates", BOT_GET_UPDATES_POOL_SIZE, BOT_POOL_TIMEOUT,
+                                         BOT_KEEPALIVE_EXPIRY)
+builder = (Application.builder().token(TOKEN).concurrent_updates(update_processor).rate_limiter(rate_limiter)
+           .request(bot_request).get_updates_request(get_updates_request))
+if BOT_API_BASE_URL:
+    builder = builder.base_url(BOT_API_BASE_URL)
+if BOT_API_BASE_FILE_URL:
+    builder = builder.base_file_url(BOT_API_BASE_FILE_URL)
+if persistence is not None:
+    builder = builder.persistence(persistence)
+app = builder.build()
 
 # Intake Conversation Handler
 p_conv = ConversationHandler(
     entry_points=[CallbackQueryHandler(p_start, pattern='^p_start$')],
     states={
         P_TERMS: [CallbackQueryHandler(p_q1, pattern='^p_agree$')],
-        P_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q2), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_ADDR: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q3), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q4), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q5), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_EDD: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q6), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_W_BEFORE: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q7), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_W_NOW: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q8), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_BIRTH: [CallbackQueryHandler(p_q9), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_GENDER: [CallbackQueryHandler(p_q10), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_DIET: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q11), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_RISK: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q12), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_ALLERGY: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q13), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_BREASTFEED: [CallbackQueryHandler(p_q14), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_LANG_PREF: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q15), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_NOTES: [MessageHandler(filters.TEXT & ~filters.COMMAND, p_q16), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_HOME: [CallbackQueryHandler(p_q17), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_PACKAGE: [CallbackQueryHandler(p_q18), CallbackQueryHandler(p_back_handler, pattern='^p_back$')],
-        P_ID: [MessageHandler(filters.PHOTO, p_final), CallbackQueryHandler(p_back_handler, pattern='^p_back$')]
+        **intake_form.states(),
     },
     fallbacks=[CommandHandler("start", start), CallbackQueryHandler(show_menu, pattern='^menu$'), CallbackQueryHandler(start, pattern='^restart$')],
-    allow_reentry=True
+    allow_reentry=True,
+    name="p_conv",
+    persistent=persistence is not None
 )
 
 # Decor Conversation Handler
 d_conv = ConversationHandler(
     entry_points=[CallbackQueryHandler(d_start, pattern='^d_start$')],
-    states={
-        D_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, d_step1)],
-        D_GENDER: [CallbackQueryHandler(d_step2)],
-        D_ADDR: [MessageHandler(filters.TEXT & ~filters.COMMAND, d_step3)],
-        D_PHONE: [MessageHandler(filters.TEXT & ~filters.COMMAND, d_step4)],
-        D_CONTACT: [MessageHandler(filters.TEXT & ~filters.COMMAND, d_step5)],
-        D_PKG: [CallbackQueryHandler(d_step6)],
-        D_DATE: [MessageHandler(filters.TEXT & ~filters.COMMAND, d_step7)],
-        D_HOUSE: [CallbackQueryHandler(d_step8)],
-        D_NOTES: [MessageHandler(filters.TEXT & ~filters.COMMAND, d_step9)],
-        D_PAYMENT: [MessageHandler(filters.PHOTO, d_final)]
-    },
+    states=decor_form.states(),
     fallbacks=[CommandHandler("start", start), CallbackQueryHandler(show_menu, pattern='^menu$'), CallbackQueryHandler(start, pattern='^restart$')],
-    allow_reentry=True
+    allow_reentry=True,
+    name="d_conv",
+    persistent=persistence is not None
 )
 
+STATE_NAMES = {value: name for name, value in globals().items()
+               if name[:2] in ("P_", "D_") and isinstance(value, int)}
+
+def _active_conversations():
+    counts = {}
+    for conv in (p_conv, d_conv):
+        for state in list(conv._conversations.values()):
+            key = (conv.name, STATE_NAMES.get(state, str(state)))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+Gauge("agos_active_conversations", "Open conversations per state.", ("conversation", "state"), _active_conversations)
+
 # Register all handlers
 app.add_handler(p_conv)
 app.add_handler(d_conv)
@@ -892,13 +2301,482 @@ app.add_handler(CallbackQueryHandler(lambda u, c: show_menu(u, c, u.callback_que
 app.add_handler(CallbackQueryHandler(lambda u, c: show_menu(u, c), pattern='^menu$'))
 app.add_handler(CallbackQueryHandler(info_pages, pattern='^info_'))
 app.add_handler(CallbackQueryHandler(start, pattern='^restart$'))
+app.add_handler(CommandHandler(list(ADMIN_COMMANDS), admin_command))
+app.add_handler(CallbackQueryHandler(admin_page_callback, pattern='^adm:'))
+app.add_handler(CallbackQueryHandler(stale_button))  # must stay last
+startup_mark("telegram application")
+
+# --- UPDATE DEDUPLICATION ---
+class UpdateDeduplicator:
+    """Remembers recently seen update_ids so Telegram redeliveries are processed only once.
+
+    The in-memory LRU answers in O(1). With a db_path, the first worker to claim an
+    update_id in the shared SQLite table wins and every other worker drops it.
+    """
+
+    def __init__(self, ttl, max_entries, db_path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.seen = OrderedDict()
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self._db = None
+        self._claims = 0
+        if db_path:
+            self._db = open_sqlite(db_path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS seen_updates "
+                             "(update_id INTEGER PRIMARY KEY, seen_at REAL NOT NULL)")
+
+    def claim(self, update_id):
+        """Return True the first time an update_id is seen within the TTL, False for duplicates."""
+        now = time.time()
+        with self._lock:
+            seen_at = self.seen.get(update_id)
+            if seen_at is not None and now - seen_at < self.ttl:
+                self.duplicates += 1
+                return False
+            if self._db is not None and not self._claim_shared(update_id, now):
+                self.seen[update_id] = now
+                self.duplicates += 1
+                return False
+            self.seen[update_id] = now
+            self.seen.move_to_end(update_id)
+            while len(self.seen) > self.max_entries:
+                self.seen.popitem(last=False)
+            return True
+
+    def release(self, update_id):
+        """Forget a claimed update_id that was not processed, so Telegram's retry is."""
+        with self._lock:
+            self.seen.pop(update_id, None)
+            if self._db is not None:
+                try:
+                    self._db.execute("DELETE FROM seen_updates WHERE update_id = ?", (update_id,))
+                except sqlite3.Error as e:
+                    logger.warning(f"Dedup store unavailable, could not release {update_id}: {e}")
+
+    def _claim_shared(self, update_id, now):
+        try:
+            cur = self._db.execute(
+                "INSERT INTO seen_updates (update_id, seen_at) VALUES (?, ?) "
+                "ON CONFLICT(update_id) DO UPDATE SET seen_at = excluded.seen_at "
+                "WHERE seen_updates.seen_at < ?",
+                (update_id, now, now - self.ttl))
+            self._claims += 1
+            if self._claims % 1000 == 0:
+                self._db.execute("DELETE FROM seen_updates WHERE seen_at < ?", (now - self.ttl,))
+            return cur.rowcount == 1
+        except sqlite3.Error as e:
+            # Never block updates because the shared store is unavailable
+            logger.warning(f"Dedup store unavailable, falling back to memory: {e}")
+            return True
+
+
+update_dedup = UpdateDeduplicator(DEDUP_TTL, DEDUP_MAX_ENTRIES, DEDUP_DB_PATH)
+
+
+# --- LOOP WATCHDOG ---
+class LoopWatchdog:
+    """Measures how late the bot loop runs a periodic timer and counts updates in flight.
+
+    A loop blocked outright cannot run the timer at all, so the time since the last
+    tick counts as lag too.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.last_tick = None
+        self.in_flight = 0
+        self.task = None
+
+    async def start(self):
+        self.last_tick = time.monotonic()
+        self.task = asyncio.create_task(self._run(), name="loop-watchdog")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        self.last_tick = None
+
+    async def _run(self):
+        while True:
+            scheduled = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_tick = time.monotonic()
+            self.lag = max(0.0, self.last_tick - scheduled - self.interval)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG_SECONDS.observe(self.lag)
+
+    def current_lag(self):
+        if self.last_tick is None:
+            return 0.0
+        return max(self.lag, time.monotonic() - self.last_tick - self.interval)
+
+    def stats(self):
+        return {"loop_lag_ms": round(1000 * self.current_lag(), 3), "loop_lag_max_ms": round(1000 * self.max_lag, 3),
+                "updates_in_flight": self.in_flight}
+
+
+LOOP_LAG_SECONDS = Histogram("agos_loop_lag_seconds", "How late the bot event loop ran the watchdog timer.")
+loop_watchdog = LoopWatchdog(WATCHDOG_INTERVAL)
+Gauge("agos_updates_in_flight", "Updates accepted but not yet fully handled.", (),
+      lambda: {(): loop_watchdog.in_flight})
+
+
+# --- PROFILING ---
+# POST /debug/profile starts one profiling window on this worker; handle_update only
+# checks ``active_profile`` against None, so nothing is paid while profiling is off.
+active_profile = None
+last_profile = None
+
+class ProfileSession:
+    """Profiles the next ``max_updates`` updates or ``seconds`` seconds, whichever ends first.
+
+    "cprofile" profiles the bot loop thread and writes a .pstats file. "sample" is a
+    wall-clock sampler over every thread (Flask workers included) and writes collapsed
+    stacks, one "frame;frame;... count" line per stack, for flamegraph tools.
+    """
+
+    def __init__(self, mode, max_updates, seconds, interval):
+        self.mode = mode
+        self.max_updates = max_updates
+        self.seconds = seconds
+        self.interval = interval
+        self.updates = 0
+        self.samples = {}
+        self.started_at = None
+        self.path = None
+        self._profiler = None
+        self._sampler = None
+        self._stopped = threading.Event()
+        self._timer = None
+
+    async def start(self):
+        """Begin profiling; runs on the bot loop so cProfile hooks the loop thread."""
+        global active_profile
+        if active_profile is not None:
+            raise RuntimeError("a profile is already running")
+        self.started_at = time.time()
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._sampler = threading.Thread(target=self._sample, name="profile-sampler", daemon=True)
+            self._sampler.start()
+        self._timer = asyncio.get_running_loop().call_later(self.seconds, self.stop)
+        active_profile = self
+        logger.info(f"🔬 Profiling ({self.mode}) for {self.max_updates} updates or {self.seconds}s")
+
+    def update_done(self):
+        self.updates += 1
+        if self.updates >= self.max_updates:
+            self.stop()
+
+    def _sample(self):
+        me = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                key = ";".join([names.get(ident, str(ident))] + stack[::-1])
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def stop(self):
+        """Finish the window and write the output file; runs on the bot loop."""
+        global active_profile, last_profile
+        if active_profile is not self:
+            return
+        active_profile, last_profile = None, self
+        self._timer.cancel()
+        if self._profiler is not None:
+            self._profiler.disable()
+        else:
+            self._stopped.set()
+            self._sampler.join()
+        stem = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started_at))}"
+                                         f"-{os.getpid()}")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if self._profiler is not None:
+                self.path = f"{stem}.pstats"
+                self._profiler.dump_stats(self.path)
+            else:
+                self.path = f"{stem}.collapsed"
+                with open(self.path, "w", encoding="utf-8") as f:
+                    for stack, count in sorted(self.samples.items()):
+                        f.write(f"{stack} {count}\n")
+            logger.info(f"🔬 Profile written to {self.path} ({self.updates} updates)")
+        except OSError as e:
+            self.path = None
+            logger.error(f"❌ Could not write profile: {e}")
+
+    def describe(self):
+        return {"mode": self.mode, "updates": self.updates, "max_updates": self.max_updates,
+                "seconds": self.seconds, "started_at": self.started_at, "path": self.path}
+
+
+def profile_session_from(args):
+    """Build a ProfileSession from request arguments; raises ValueError on bad input."""
+    mode = args.get("mode", "sample")
+    if mode not in ("cprofile", "sample"):
+        raise ValueError(f"unknown mode: {mode}")
+    try:
+        max_updates = int(args.get("updates", "100"))
+        seconds = min(float(args.get("seconds", "30")), PROFILE_MAX_SECONDS)
+        interval = float(args.get("interval_ms", "5")) / 1000
+    except ValueError:
+        raise ValueError("updates, seconds and interval_ms must be numbers")
+    if max_updates < 1 or seconds <= 0 or interval <= 0:
+        raise ValueError("updates, seconds and interval_ms must be positive")
+    return ProfileSession(mode, max_updates, seconds, interval)
+
+def profile_status():
+    return {"active": active_profile.describe() if active_profile is not None else None,
+            "last": last_profile.describe() if last_profile is not None else None}
+
+
+# --- UPDATE QUEUE ---
+class UpdateQueue:
+    """Bounded in-process queue of raw updates drained by a pool of async consumers.
+
+    A consumer that takes an update of a chat another consumer is already running
+    parks it on that chat's backlog and moves on, so a busy chat occupies one consumer
+    and other chats never wait behind it. Parked updates still count towards depth().
+    """
+
+    def __init__(self, maxsize, high_water, consumers):
+        self.maxsize = maxsize
+        self.high_water = min(high_water, maxsize)
+        self.consumers = consumers
+        self.queue = None
+        self.tasks = []
+        self.rejected = 0
+        self.backlogs = {}  # chat_id -> updates parked while a consumer runs that chat
+        self.parked = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(self.maxsize)
+        self.tasks = [asyncio.create_task(self._consume(), name=f"update-consumer-{i}")
+                      for i in range(self.consumers)]
+        logger.info(f"📥 Update queue started ({self.consumers} consumers, high-water {self.high_water})")
+
+    async def stop(self, timeout=10):
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Dropping {self.queue.qsize()} queued updates on shutdown")
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queue = None
+        self.backlogs.clear()
+        self.parked = 0
+
+    def depth(self):
+        return self.queue.qsize() + self.parked if self.queue is not None else 0
+
+    def offer(self, update_data):
+        """Queue an update without waiting; False means the caller should shed load."""
+        if self.queue is None or self.depth() >= self.high_water:
+            self.rejected += 1
+            return False
+        self.queue.put_nowait(update_data)
+        return True
+
+    async def offer_async(self, update_data):
+        return self.offer(update_data)
+
+    async def _consume(self):
+        while True:
+            update_data = await self.queue.get()
+            try:
+                update = Update.de_json(update_data, app.bot)
+            except Exception as e:
+                logger.error(f"❌ Queued update {update_data.get('update_id')} failed: {e}", exc_info=True)
+                self.queue.task_done()
+                continue
+            chat_id = update.effective_chat.id if update.effective_chat else None
+            backlog = self.backlogs.get(chat_id)
+            if backlog is not None:
+                backlog.append(update)
+                self.parked += 1
+                continue
+            if chat_id is not None:
+                self.backlogs[chat_id] = backlog = deque()
+            try:
+                await self._run(update)
+                while backlog:
+                    self.parked -= 1
+                    await self._run(backlog.popleft())
+            finally:
+                self.backlogs.pop(chat_id, None)
+
+    async def _run(self, update):
+        try:
+            await run_update(update)
+        except Exception as e:
+            logger.error(f"❌ Queued update {update.update_id} failed: {e}", exc_info=True)
+        finally:
+            self.queue.task_done()
+
+
+update_queue = UpdateQueue(UPDATE_QUEUE_SIZE, UPDATE_QUEUE_HIGH_WATER, UPDATE_CONSUMERS)
+
+
+def is_valid_update(update_data):
+    return isinstance(update_data, dict) and isinstance(update_data.get("update_id"), int)
+
+
+async def start_bot():
+    """Initialize and start the application (and its consumers) on the running loop."""
+    started = time.perf_counter()
+    pdf_renderer.prewarm()
+    await app.initialize()
+    await app.start()
+    await admin_outbox.start()
+    await loop_watchdog.start()
+    if WEBHOOK_ACK_MODE == "queue":
+        await update_queue.start()
+    startup_timings["bot initialize"] = round(1000 * (time.perf_counter() - started), 1)
+    logger.info(f"⏱️ Startup: {startup_report()}")
+
+
+async def stop_bot():
+    if WEBHOOK_ACK_MODE == "queue":
+        await update_queue.stop()
+    await loop_watchdog.stop()
+    await admin_outbox.stop()
+    if app.running:
+        await app.stop()
+    await app.shutdown()
+    pdf_renderer.shutdown()
+
+
+# --- BOT EVENT LOOP (ONE PER WORKER) ---
+class BotLoopThread:
+    """Runs one long-lived event loop in a background thread and owns the bot lifecycle on it."""
+
+    def __init__(self):
+        self.loop = None
+        self.thread = None
+        self.pid = None
+        self.init_time = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.pid == os.getpid() and self.thread is not None and self.thread.is_alive()
+
+    def start(self):
+        """Start the loop thread and initialize the bot once per process (fork safe)."""
+        with self._lock:
+            if self.running:
+                return self
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self._run, name="bot-event-loop", daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
+            logger.info(f"🚀 Initializing bot application on worker loop (pid {self.pid})...")
+            try:
+                self.run(start_bot())
+            except Exception:
+                # Leave no half-started loop behind so the next call can try again
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.thread.join(timeout=5)
+                self.loop.close()
+                self.thread = None
+                raise
+            self.init_time = time.monotonic()
+            logger.info("✅ Bot initialized successfully")
+            return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the bot loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the bot loop and block the calling thread until it finishes."""
+        return self.submit(coro).result(timeout)
+
+    def stop(self):
+        with self._lock:
+            if not self.running:
+                return
+            try:
+                self.run(stop_bot(), timeout=20)
+            except Exception as e:
+                logger.warning(f"Bot shutdown did not complete cleanly: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(timeout=5)
+            self.loop.close()
+            self.thread = None
+            logger.info("🔴 Bot event loop stopped")
+
+
+bot_loop = BotLoopThread()
+atexit.register(bot_loop.stop)
+
+
+def get_bot_loop():
+    """Return this worker's bot loop, starting it on first use."""
+    if not bot_loop.running:
+        bot_loop.start()
+    return bot_loop
+
+
+def boot_worker():
+    """Start the bot as soon as a WSGI worker is forked instead of on its first webhook.
+
+    Called from the post_fork hook in gunicorn.conf.py. A failure is only logged; the
+    first webhook then tries again.
+    """
+    if WEBHOOK_LOOP_MODE != "persistent":
+        return
+    try:
+        get_bot_loop()
+    except Exception as e:
+        logger.error(f"❌ Bot startup at worker boot failed: {e}", exc_info=True)
+
+
+async def _process_update(update):
+    await refresh_conversations(update)
+    await app.process_update(update)
+
+
+async def handle_update(update_data):
+    """Deserialize one Telegram update and run it through the per-chat scheduler."""
+    await run_update(Update.de_json(update_data, app.bot))
+
+async def run_update(update):
+    loop_watchdog.in_flight += 1
+    try:
+        await app.update_processor.process_update(update, _process_update(update))
+    finally:
+        loop_watchdog.in_flight -= 1
+        if active_profile is not None:
+            active_profile.update_done()
 
-# --- FLASK WEBHOOK SERVER ---
-# --- FLASK WEBHOOK SERVER (PRODUCTION READY) ---
-import nest_asyncio
-nest_asyncio.apply()  # Allow nested event loops
 
+# --- FLASK WEBHOOK SERVER (PRODUCTION READY) ---
 flask_app = Flask(__name__)
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
 
 @flask_app.route(f"/{TOKEN}", methods=["POST"])
 def webhook():
@@ -906,72 +2784,410 @@ def webhook():
     if request.method == "POST":
         request_id = hash(request.data) % 10000  # Simple request tracking
         logger.info(f"[{request_id}] 🔵 Webhook received")
-        
-        # Create new event loop for this request
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
+
+        if WEBHOOK_LOOP_MODE == "per_request":
+            return _webhook_per_request(request_id)
+
+        claimed = None  # released again on every non-200 answer so the retry is processed
         try:
-            # Parse update
-            update_data = request.get_json(force=True)
+            update_data = request.get_json(force=True, silent=True)
+            if not is_valid_update(update_data):
+                logger.warning(f"[{request_id}] ⚠️ Rejected malformed update")
+                return Response("bad request", status=400)
             logger.info(f"[{request_id}] 📦 Update ID: {update_data.get('update_id')}")
-            
-            # Initialize app once (first request only)
-            if not hasattr(flask_app, '_bot_initialized'):
-                logger.info(f"[{request_id}] 🚀 Initializing bot application...")
-                loop.run_until_complete(app.initialize())
-                loop.run_until_complete(app.start())
-                flask_app._bot_initialized = True
-                flask_app._bot_init_time = asyncio.get_event_loop().time()
-                logger.info(f"[{request_id}] ✅ Bot initialized successfully")
-            
-            # Process the update
-            update = Update.de_json(update_data, app.bot)
-            loop.run_until_complete(app.process_update(update))
+            if not update_dedup.claim(update_data["update_id"]):
+                logger.info(f"[{request_id}] ♻️ Duplicate update dropped")
+                return Response("ok", status=200)
+            claimed = update_data["update_id"]
+            if WEBHOOK_ACK_MODE == "queue":
+                if not get_bot_loop().run(update_queue.offer_async(update_data), timeout=5):
+                    logger.warning(f"[{request_id}] 🛑 Update queue full, shedding load")
+                    update_dedup.release(claimed)
+                    return Response("busy", status=503)
+                return Response("ok", status=200)
+            future = get_bot_loop().submit(handle_update(update_data))
+            try:
+                future.result(WEBHOOK_PROCESS_TIMEOUT)
+            except FutureTimeoutError:
+                # Still running on the bot loop: keep the claim so Telegram's redelivery is
+                # dropped, and give it up only if the update fails after all
+                future.add_done_callback(functools.partial(_release_if_failed, claimed))
+                claimed = None
+                raise
             logger.info(f"[{request_id}] ✅ Update processed successfully")
             return Response("ok", status=200)
-            
         except Exception as e:
             logger.error(f"[{request_id}] ❌ Webhook error: {str(e)}", exc_info=True)
+            if claimed is not None:
+                update_dedup.release(claimed)
             return Response(f"error: {str(e)}", status=500)
-        finally:
-            loop.close()
-            logger.info(f"[{request_id}] 🔴 Loop closed")
-    
+
     return Response("method not allowed", status=405)
 
-@flask_app.route("/")
-def home():
-    """Home endpoint - health check"""
+def _release_if_failed(update_id, future):
+    if future.cancelled() or future.exception() is not None:
+        update_dedup.release(update_id)
+
+def _webhook_per_request(request_id):
+    """Legacy mode: a fresh event loop for every webhook call (needs nest_asyncio)."""
+    # Create new event loop for this request
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    claimed = None
+
+    try:
+        # Parse update
+        update_data = request.get_json(force=True)
+        logger.info(f"[{request_id}] 📦 Update ID: {update_data.get('update_id')}")
+
+        # Initialize app once (first request only)
+        if not hasattr(flask_app, '_bot_initialized'):
+            logger.info(f"[{request_id}] 🚀 Initializing bot application...")
+            loop.run_until_complete(app.initialize())
+            loop.run_until_complete(app.start())
+            flask_app._bot_initialized = True
+            flask_app._bot_init_time = time.monotonic()
+            logger.info(f"[{request_id}] ✅ Bot initialized successfully")
+
+        # Process the update
+        if not update_dedup.claim(update_data.get('update_id')):
+            logger.info(f"[{request_id}] ♻️ Duplicate update dropped")
+            return Response("ok", status=200)
+        claimed = update_data.get('update_id')
+        loop.run_until_complete(handle_update(update_data))
+        # No flusher task outlives this loop, so deliver the admin outbox before closing it
+        loop.run_until_complete(admin_outbox.drain())
+        logger.info(f"[{request_id}] ✅ Update processed successfully")
+        return Response("ok", status=200)
+
+    except Exception as e:
+        logger.error(f"[{request_id}] ❌ Webhook error: {str(e)}", exc_info=True)
+        if claimed is not None:
+            update_dedup.release(claimed)
+        return Response(f"error: {str(e)}", status=500)
+    finally:
+        loop.close()
+        logger.info(f"[{request_id}] 🔴 Loop closed")
+
+def _bot_initialized():
+    if asgi_state["init_time"] is not None:
+        return True
+    if WEBHOOK_LOOP_MODE == "per_request":
+        return hasattr(flask_app, '_bot_initialized')
+    return bot_loop.running
+
+def _bot_init_time():
+    if asgi_state["init_time"] is not None:
+        return asgi_state["init_time"]
+    if WEBHOOK_LOOP_MODE == "per_request":
+        return getattr(flask_app, '_bot_init_time', None)
+    return bot_loop.init_time if bot_loop.running else None
+
+def _server_mode():
+    return "asgi" if asgi_state["init_time"] is not None else f"wsgi/{WEBHOOK_LOOP_MODE}"
+
+def _status_payload():
     status = {
         "status": "running",
         "bot_token_configured": bool(TOKEN),
         "admin_id_configured": ADMIN_ID != 123456789,
-        "bot_initialized": hasattr(flask_app, '_bot_initialized'),
+        "bot_initialized": _bot_initialized(),
+        "server_mode": _server_mode(),
+        "ack_mode": WEBHOOK_ACK_MODE,
+        "duplicate_updates_dropped": update_dedup.duplicates,
         "message": "Agos Postpartum Care Bot is running"
     }
-    if hasattr(flask_app, '_bot_init_time'):
-        status["uptime"] = asyncio.get_event_loop().time() - flask_app._bot_init_time
-    
-    return jsonify(status)
+    if _bot_init_time() is not None:
+        status["uptime"] = time.monotonic() - _bot_init_time()
+    status["scheduler"] = update_processor.stats()
+    status["pdf_renderer"] = pdf_renderer.stats()
+    status["rate_limiter"] = rate_limiter.stats()
+    status["admin_outbox"] = admin_outbox.stats()
+    status["watchdog"] = loop_watchdog.stats()
+    status["file_ids"] = file_id_cache.stats()
+    status["bot_api_pools"] = {"send": bot_request.stats(), "get_updates": get_updates_request.stats()}
+    if WEBHOOK_ACK_MODE == "queue":
+        status["update_queue"] = {"depth": update_queue.depth(), "high_water": update_queue.high_water,
+                                  "rejected": update_queue.rejected}
+    return status
+
+def _ready_payload():
+    """Readiness of this worker as (payload, HTTP status)."""
+    reasons = []
+    # per_request mode initializes the bot inside its first webhook, which a
+    # load balancer holding traffic back until /ready would never send
+    if WEBHOOK_LOOP_MODE != "per_request" and not _bot_initialized():
+        reasons.append("bot not initialized")
+    lag = loop_watchdog.current_lag()
+    if lag > READY_MAX_LOOP_LAG:
+        reasons.append(f"event loop lag {lag:.3f}s > {READY_MAX_LOOP_LAG}s")
+    if loop_watchdog.in_flight > READY_MAX_IN_FLIGHT:
+        reasons.append(f"{loop_watchdog.in_flight} updates in flight > {READY_MAX_IN_FLIGHT}")
+    depth = update_queue.depth()
+    if depth > READY_MAX_QUEUE_DEPTH:
+        reasons.append(f"update queue depth {depth} > {READY_MAX_QUEUE_DEPTH}")
+    payload = {"ready": not reasons, "reasons": reasons, "queue_depth": depth, **loop_watchdog.stats()}
+    return payload, 503 if reasons else 200
+
+def _debug_payload():
+    return {
+        "bot_token_set": bool(TOKEN),
+        "admin_id": ADMIN_ID,
+        "logo_path": LOGO_PATH,
+        "logo_exists": os.path.exists(LOGO_PATH),
+        "persistence": PERSISTENCE_BACKEND or "memory",
+        "bot_initialized": _bot_initialized(),
+        "server_mode": _server_mode(),
+        "python_telegram_bot_version": "20.7",
+        "flask_version": "3.0.0",
+        "startup_ms": startup_timings
+    }
+
+@flask_app.route("/")
+def home():
+    """Home endpoint - health check"""
+    return jsonify(_status_payload())
 
 @flask_app.route("/health")
 def health():
     """Kubernetes health check endpoint"""
     return Response("OK", status=200)
 
+@flask_app.route("/ready")
+def ready():
+    """Readiness probe: 503 while this worker's loop is lagging or backed up"""
+    if WEBHOOK_LOOP_MODE == "persistent":
+        try:
+            get_bot_loop()  # a fresh worker warms up on its first probe
+        except Exception as e:
+            logger.error(f"❌ Bot startup failed: {e}", exc_info=True)
+    payload, status = _ready_payload()
+    return jsonify(payload), status
+
 @flask_app.route("/debug")
 def debug():
     """Debug endpoint to check configuration"""
-    return jsonify({
-        "bot_token_set": bool(TOKEN),
-        "admin_id": ADMIN_ID,
-        "logo_path": LOGO_PATH,
-        "logo_exists": os.path.exists(LOGO_PATH),
-        "bot_initialized": hasattr(flask_app, '_bot_initialized'),
-        "python_telegram_bot_version": "20.7",
-        "flask_version": "3.0.0"
+    return jsonify(_debug_payload())
+
+@flask_app.route("/debug/profile", methods=["GET", "POST"])
+def debug_profile():
+    """GET: profiler status. POST: profile the next updates (requires ADMIN_API_TOKEN)"""
+    if not ADMIN_API_TOKEN:
+        return Response("not found", status=404)
+    if not admin_authorized(request.headers.get("Authorization"), request.args.get("token")):
+        return Response("unauthorized", status=401)
+    if request.method == "GET":
+        return jsonify(profile_status())
+    if WEBHOOK_LOOP_MODE == "per_request":
+        return Response("profiling needs the persistent event loop", status=409)
+    try:
+        session = profile_session_from(request.args)
+        get_bot_loop().run(session.start(), timeout=5)
+    except ValueError as e:
+        return Response(str(e), status=400)
+    except RuntimeError as e:
+        return Response(str(e), status=409)
+    return jsonify(profile_status()), 202
+
+@flask_app.route("/metrics")
+def metrics():
+    """Prometheus scrape endpoint"""
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@flask_app.after_request
+def _count_webhook_status(response):
+    if request.path == f"/{TOKEN}":
+        WEBHOOK_REQUESTS.inc(str(response.status_code))
+    return response
+
+@flask_app.route("/export")
+def export():
+    """Stream submissions as CSV or XLSX (requires ADMIN_API_TOKEN)"""
+    if not ADMIN_API_TOKEN:
+        return Response("not found", status=404)
+    if not admin_authorized(request.headers.get("Authorization"), request.args.get("token")):
+        return Response("unauthorized", status=401)
+    try:
+        content_type, filename, chunks = build_export(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400)
+    logger.info(f"📤 Export started: {filename}")
+    return Response(chunks, content_type=content_type,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+# --- ASGI WEBHOOK SERVER ---
+# Native async entry point: updates run directly on the server's event loop, no
+# sync/async bridge. Run with an async worker, e.g.
+#   gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 main:asgi_app
+asgi_state = {"init_time": None}
+
+async def _asgi_read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+async def _asgi_respond(send, status, body, content_type="text/plain; charset=utf-8"):
+    if not isinstance(body, bytes):
+        body = body.encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode()), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _asgi_json(send, payload, status=200):
+    await _asgi_respond(send, status, json.dumps(payload), "application/json")
+
+async def _asgi_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                logger.info("🚀 Initializing bot application on ASGI loop...")
+                await start_bot()
+                asgi_state["init_time"] = time.monotonic()
+                logger.info("✅ Bot initialized successfully")
+                await send({"type": "lifespan.startup.complete"})
+            except Exception as e:
+                logger.error(f"❌ Bot startup failed: {e}", exc_info=True)
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+        elif message["type"] == "lifespan.shutdown":
+            await stop_bot()
+            asgi_state["init_time"] = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def _asgi_webhook(receive, send):
+    body = await _asgi_read_body(receive)
+    request_id = hash(body) % 10000  # Simple request tracking
+    logger.info(f"[{request_id}] 🔵 Webhook received")
+    claimed = None
+    try:
+        try:
+            update_data = json.loads(body)
+        except ValueError:
+            update_data = None
+        if not is_valid_update(update_data):
+            logger.warning(f"[{request_id}] ⚠️ Rejected malformed update")
+            return await _asgi_respond(send, 400, "bad request")
+        logger.info(f"[{request_id}] 📦 Update ID: {update_data.get('update_id')}")
+        if not update_dedup.claim(update_data["update_id"]):
+            logger.info(f"[{request_id}] ♻️ Duplicate update dropped")
+            return await _asgi_respond(send, 200, "ok")
+        claimed = update_data["update_id"]
+        if WEBHOOK_ACK_MODE == "queue":
+            if not update_queue.offer(update_data):
+                logger.warning(f"[{request_id}] 🛑 Update queue full, shedding load")
+                update_dedup.release(claimed)
+                return await _asgi_respond(send, 503, "busy")
+            return await _asgi_respond(send, 200, "ok")
+        await handle_update(update_data)
+        logger.info(f"[{request_id}] ✅ Update processed successfully")
+        await _asgi_respond(send, 200, "ok")
+    except Exception as e:
+        logger.error(f"[{request_id}] ❌ Webhook error: {str(e)}", exc_info=True)
+        if claimed is not None:
+            update_dedup.release(claimed)
+        await _asgi_respond(send, 500, f"error: {str(e)}")
+
+def _asgi_admin_args(scope):
+    """Query arguments of an admin request, or None if it is not authorized."""
+    headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope["headers"]}
+    args = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode()).items()}
+    return args if admin_authorized(headers.get("authorization"), args.get("token")) else None
+
+async def _asgi_profile(scope, send):
+    if not ADMIN_API_TOKEN:
+        return await _asgi_respond(send, 404, "not found")
+    args = _asgi_admin_args(scope)
+    if args is None:
+        return await _asgi_respond(send, 401, "unauthorized")
+    if scope["method"] == "GET":
+        return await _asgi_json(send, profile_status())
+    if scope["method"] != "POST":
+        return await _asgi_respond(send, 405, "method not allowed")
+    try:
+        session = profile_session_from(args)
+        await session.start()
+    except ValueError as e:
+        return await _asgi_respond(send, 400, str(e))
+    except RuntimeError as e:
+        return await _asgi_respond(send, 409, str(e))
+    await _asgi_json(send, profile_status(), 202)
+
+async def _asgi_export(scope, send):
+    if not ADMIN_API_TOKEN:
+        return await _asgi_respond(send, 404, "not found")
+    args = _asgi_admin_args(scope)
+    if args is None:
+        return await _asgi_respond(send, 401, "unauthorized")
+    try:
+        content_type, filename, chunks = build_export(args)
+    except ValueError as e:
+        return await _asgi_respond(send, 400, str(e))
+    logger.info(f"📤 Export started: {filename}")
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", content_type.encode()),
+                    (b"content-disposition", f'attachment; filename="{filename}"'.encode())],
     })
+    loop = asyncio.get_running_loop()
+    try:
+        # SQLite reads and zip compression happen in a worker thread, one chunk at a time
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        chunks.close()
+
+async def asgi_app(scope, receive, send):
+    """ASGI application exposing the same routes as flask_app."""
+    if scope["type"] == "lifespan":
+        return await _asgi_lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == f"/{TOKEN}":
+        if method != "POST":
+            return await _asgi_respond(send, 405, "method not allowed")
+        async def send_counted(message):
+            if message["type"] == "http.response.start":
+                WEBHOOK_REQUESTS.inc(str(message["status"]))
+            await send(message)
+        return await _asgi_webhook(receive, send_counted)
+    if path == "/debug/profile":
+        return await _asgi_profile(scope, send)
+    if method not in ("GET", "HEAD"):
+        return await _asgi_respond(send, 405, "method not allowed")
+    if path == "/":
+        return await _asgi_json(send, _status_payload())
+    if path == "/health":
+        return await _asgi_respond(send, 200, "OK")
+    if path == "/ready":
+        payload, status = _ready_payload()
+        return await _asgi_json(send, payload, status)
+    if path == "/debug":
+        return await _asgi_json(send, _debug_payload())
+    if path == "/export":
+        return await _asgi_export(scope, send)
+    if path == "/metrics":
+        return await _asgi_respond(send, 200, render_metrics(), METRICS_CONTENT_TYPE)
+    await _asgi_respond(send, 404, "not found")
+
+def startup_report():
+    return ", ".join(f"{step} {ms:.0f}ms" for step, ms in startup_timings.items())
+
+startup_mark("web servers")
+logger.info(f"⏱️ Module loaded: {startup_report()}")
 
 # This is ONLY for local testing - In production, Choreo uses gunicorn
 if __name__ == "__main__":
@@ -987,4 +3203,5 @@ if __name__ == "__main__":
     else:
         logger.info("🟢 This module is meant to be imported by gunicorn")
         logger.info("📝 To run locally with gunicorn: gunicorn --bind 0.0.0.0:8080 main:flask_app")
+        logger.info("📝 Or the ASGI server: gunicorn -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8080 main:asgi_app")
 
@@ -0,0 +1,123 @@
+"""PDF rendering for the bot: intake receipts and the service agreement.
+
+Kept apart from main.py so PDF_EXECUTOR=process workers import only this module,
+not the bot, its databases and the Application. Everything here is a plain function
+of its arguments and safe to run in any process.
+"""
+import functools
+import logging
+import os
+import time
+from io import BytesIO
+
+logger = logging.getLogger(__name__)
+
+PAGE_WIDTH, PAGE_HEIGHT = 612.0, 792.0  # reportlab.lib.pagesizes.letter
+_logo_cache = {}
+
+@functools.lru_cache(maxsize=None)
+def pdf_stack():
+    """Import ReportLab and Pillow on first use; they are a large share of import time."""
+    from reportlab import rl_config
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.utils import ImageReader
+    from PIL import Image
+    # Binary (Flate-only) streams: ASCII85 text encoding of the logo was most of the render time
+    rl_config.useA85 = 0
+    return canvas, ImageReader, Image
+
+def flatten_image(path):
+    """Open an image and bake any transparency onto white; returns an RGB PIL image."""
+    Image = pdf_stack()[2]
+    with Image.open(path) as im:
+        rgba = im.convert("RGBA")
+    flat = Image.new("RGB", rgba.size, (255, 255, 255))
+    flat.paste(rgba, mask=rgba.getchannel("A"))
+    return flat
+
+def get_logo(logo_path):
+    """Decode and flatten the logo once per process; None if it is missing or unreadable."""
+    if logo_path not in _logo_cache:
+        ImageReader = pdf_stack()[1]
+        logo = None
+        if logo_path and os.path.exists(logo_path):
+            try:
+                # The letterhead is always on a white page, so bake the alpha in instead of
+                # embedding a soft mask in every PDF
+                logo = ImageReader(flatten_image(logo_path))
+                logo.getRGBData()  # cache the raw pixel data on the reader
+            except Exception as e:
+                logger.warning(f"Could not load logo: {e}")
+        _logo_cache[logo_path] = logo
+    return _logo_cache[logo_path]
+
+def _draw_letterhead(c, logo_path, subtitle="Official Intake Confirmation Form"):
+    logo = get_logo(logo_path)
+    if logo is not None:
+        c.drawImage(logo, 480, PAGE_HEIGHT - 80, width=60, height=60)
+    c.setFont("Helvetica-Bold", 18)
+    c.drawString(50, PAGE_HEIGHT - 50, "Agos Postpartum Care")
+    c.setFont("Helvetica", 12)
+    c.drawString(50, PAGE_HEIGHT - 70, subtitle)
+    c.line(50, PAGE_HEIGHT - 85, 550, PAGE_HEIGHT - 85)
+
+def render_intake_pdf(fields, logo_path):
+    """Render an intake snapshot to PDF bytes. Runs inside the PDF executor."""
+    canvas = pdf_stack()[0]
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
+    _draw_letterhead(c, logo_path)
+    c.setFont("Helvetica", 11)
+    y_position = PAGE_HEIGHT - 120
+
+    for key, value in fields:
+        label = key[2:].replace('_', ' ').upper()
+        text = f"{label}: {value}"
+        c.drawString(50, y_position, text)
+        y_position -= 25
+        if y_position < 60:
+            c.showPage()
+            y_position = PAGE_HEIGHT - 50
+
+    c.setFont("Helvetica-Oblique", 9)
+    c.drawString(50, 40, "Generated via Agos Telegram Bot. Verified submission.")
+    c.save()
+    return buffer.getvalue()
+
+def render_terms_pdf(text, font_path, logo_path):
+    """Render the service agreement to PDF bytes. Runs inside the PDF executor."""
+    canvas = pdf_stack()[0]
+    from reportlab.lib.utils import simpleSplit
+    font = "Helvetica"
+    if font_path:
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+        pdfmetrics.registerFont(TTFont("AgosTerms", font_path))
+        font = "AgosTerms"
+    buffer = BytesIO()
+    c = canvas.Canvas(buffer, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
+    _draw_letterhead(c, logo_path, "Service Agreement")
+    c.setFont(font, 10)
+    y_position = PAGE_HEIGHT - 110
+    for paragraph in text.split("\n"):
+        for line in simpleSplit(paragraph, font, 10, PAGE_WIDTH - 100) or [""]:
+            if y_position < 50:
+                c.showPage()
+                c.setFont(font, 10)
+                y_position = PAGE_HEIGHT - 50
+            c.drawString(50, y_position, line)
+            y_position -= 14
+    c.save()
+    return buffer.getvalue()
+
+def prewarm_pdf(logo_path):
+    """Import the PDF stack, decode the logo and render a throwaway page; returns seconds."""
+    started = time.perf_counter()
+    render_intake_pdf((("p_name", "prewarm"),), logo_path)
+    return time.perf_counter() - started
+
+def timed_render_intake(fields, logo_path):
+    # Timed in the worker so the metric excludes executor queueing (and works across processes)
+    started = time.perf_counter()
+    pdf = render_intake_pdf(fields, logo_path)
+    return pdf, time.perf_counter() - started
@@ -0,0 +1,64 @@
+"""Checks for the precompiled UI: static Markdown texts and the terms chunks.
+
+    python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="agos-tests-")
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+for name, filename in (("SUBMISSIONS_DB_PATH", "submissions.sqlite3"), ("OUTBOX_DB_PATH", "outbox.sqlite3"),
+                       ("PERSISTENCE_PATH", "state.sqlite3"), ("FILE_ID_CACHE_PATH", "file_ids.sqlite3")):
+    os.environ.setdefault(name, os.path.join(WORKDIR, filename))
+sys.path.insert(0, ROOT)
+import main  # noqa: E402
+
+
+def markdown_texts():
+    """Every static text sent with parse_mode='Markdown', as (name, text) pairs."""
+    for lang, ui in main.UI.items():
+        for key, text in main.CONTENT[lang].items():
+            if key == 'welcome' or key.endswith('_text'):
+                yield f"CONTENT[{lang!r}][{key!r}]", text
+        for i, chunk in enumerate(ui['terms']):
+            yield f"terms chunk {i + 1} ({lang})", chunk
+
+
+@pytest.mark.parametrize("name,text", list(markdown_texts()), ids=lambda value: value if len(value) < 40 else "")
+def test_static_markdown_is_balanced(name, text):
+    offset = main.markdown_unbalanced(text)
+    assert offset is None, f"Unbalanced Markdown in {name} at offset {offset}: {text[offset:offset + 40]!r}"
+
+
+@pytest.mark.parametrize("text,offset", [
+    ("*bold* and _italic_", None),
+    ("an `inline * code`", None),
+    ("escaped \\* star", None),
+    ("[a_link](https://example.com/a_b)", None),
+    ("*bold never closed", 0),
+    ("*no _nesting* here", None),
+    ("snake_case", 5),
+])
+def test_markdown_unbalanced(text, offset):
+    assert main.markdown_unbalanced(text) == offset
+
+
+@pytest.mark.parametrize("lang", sorted(main.TERMS))
+def test_terms_chunks_fit_and_keep_every_paragraph(lang):
+    chunks = main.UI[lang]['terms']
+    assert chunks
+    assert all(len(chunk) <= main.TERMS_CHUNK_LIMIT for chunk in chunks)
+    assert "\n\n".join(chunks).split() == main.TERMS[lang].split()
+
+
+def test_split_paragraphs_falls_back_to_lines_and_words():
+    text = "short paragraph\n\n" + "\n".join(["word " * 30] * 3)
+    chunks = main.split_paragraphs(text, 60)
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert " ".join(chunks).split() == text.split()
+    assert main.split_paragraphs("", 60) == []
+    assert main.split_paragraphs("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]